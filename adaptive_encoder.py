@@ -0,0 +1,75 @@
+import cv2
+
+from geometry import fit_to_input
+
+
+class AdaptiveEncoder:
+    """JPEG encoder that trades quality and resolution for latency on the wearable.
+
+    After every reply the client reports the frame's round-trip time and payload
+    size. The controller keeps a moving average of the RTT and, every
+    `adjust_every` replies, steps towards `target_rtt`:
+
+    - too slow: lower JPEG quality first, then the downscale factor
+    - comfortably fast: restore resolution first, then quality
+
+    Quality stays within [min_quality, max_quality] and the scale within
+    [min_scale, 1.0]. The scale applies to the model input size when one is
+    given (frames are never sent larger than the model uses), otherwise to the
+    captured frame.
+    """
+
+    def __init__(self, target_rtt=0.25, min_quality=35, max_quality=80, min_scale=0.5,
+                 quality_step=5, scale_step=0.1, adjust_every=5, smoothing=0.3):
+        self.target_rtt = target_rtt
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale
+        self.quality_step = quality_step
+        self.scale_step = scale_step
+        self.adjust_every = adjust_every
+        self.smoothing = smoothing
+
+        self.quality = max_quality
+        self.scale = 1.0
+        self.rtt = None
+        self.payload_bytes = None
+        self._replies = 0
+
+    def encode(self, frame, input_size=None):
+        """Encode a frame with the current settings. Returns JPEG bytes."""
+        longest_side = input_size or max(frame.shape[:2])
+        frame = fit_to_input(frame, max(1, int(longest_side * self.scale)))
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buffer.tobytes()
+
+    def record(self, rtt, payload_bytes):
+        """Feed back one frame's round-trip time (seconds) and encoded size."""
+        a = self.smoothing
+        self.rtt = rtt if self.rtt is None else a * rtt + (1 - a) * self.rtt
+        self.payload_bytes = (payload_bytes if self.payload_bytes is None
+                              else a * payload_bytes + (1 - a) * self.payload_bytes)
+
+        self._replies += 1
+        if self._replies % self.adjust_every == 0:
+            self._adjust()
+
+    def _adjust(self):
+        if self.rtt > self.target_rtt * 1.1:
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - self.quality_step)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, round(self.scale - self.scale_step, 2))
+        elif self.rtt < self.target_rtt * 0.7:
+            if self.scale < 1.0:
+                self.scale = min(1.0, round(self.scale + self.scale_step, 2))
+            elif self.quality < self.max_quality:
+                self.quality = min(self.max_quality, self.quality + self.quality_step)
+
+    def stats(self):
+        return {
+            "quality": self.quality,
+            "scale": self.scale,
+            "rtt_ms": None if self.rtt is None else round(self.rtt * 1000, 1),
+            "payload_kb": None if self.payload_bytes is None else round(self.payload_bytes / 1024, 1),
+        }
@@ -0,0 +1,212 @@
+import hashlib
+import itertools
+import os
+import queue
+import threading
+import time
+import pygame
+
+# Audio feedback for the detection loops.
+#
+# The denomination clips are decoded into memory once (pygame.mixer.Sound) and
+# played by a single audio thread, so announcing a detection never touches the
+# disk, never starts a thread and never blocks the caller. Requests wait in a
+# priority queue; a label that is already waiting is not queued again, and a
+# label is not repeated within its cooldown.
+#
+# Spoken phrases (class names, "Switched to ... mode") go through the same
+# thread. They are synthesized once with pyttsx3 into WAV files under
+# TTS_CACHE_DIR, keyed by text, voice and rate, and then played from memory like
+# the clips. Only text that was never rendered pays for synthesis, once.
+
+CLIP_DIR = os.path.dirname(os.path.abspath(__file__))
+DENOMINATION_CLIPS = {label: f"{label}.mp3" for label in ("10", "20", "50", "100", "500")}
+TTS_CACHE_DIR = os.path.join(CLIP_DIR, "tts_cache")
+
+PRIORITY_SYSTEM = 0     # mode changes, connection state: played first
+PRIORITY_DETECTION = 1
+PRIORITY_RENDER = 2     # pre-rendering phrases: only when nothing is waiting to play
+PRIORITY_STOP = 99      # close(): after everything already queued
+# Phrases per pre-render job: anything queued meanwhile waits for one chunk at most
+RENDER_CHUNK = 4
+
+
+class PhraseCache:
+    """Phrases rendered once with a pyttsx3 engine, kept as WAV files and in memory.
+
+    Only used from the audio thread: pyttsx3 engines are not thread-safe.
+    """
+
+    def __init__(self, engine, directory=TTS_CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.engine = engine
+        self.directory = directory
+        self.sounds = {}  # text -> Sound
+        self.rendered = 0
+
+    def path(self, text):
+        key = f"{text}|{self.engine.getProperty('voice')}|{self.engine.getProperty('rate')}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest()[:20] + ".wav")
+
+    def render(self, texts):
+        """Synthesize the phrases that are not on disk yet, in one engine run."""
+        missing = {}
+        for text in texts:
+            path = self.path(text)
+            if not os.path.exists(path):
+                missing[text] = path
+        if not missing:
+            return
+        for text, path in missing.items():
+            self.engine.save_to_file(text, path + ".part.wav")
+        self.engine.runAndWait()
+        for text, path in missing.items():
+            # Renamed only when complete, so an interrupted run leaves no half phrase
+            if os.path.exists(path + ".part.wav"):
+                os.replace(path + ".part.wav", path)
+                self.rendered += 1
+
+    def sound(self, text):
+        """The phrase as an in-memory Sound, or None if it isn't rendered (or won't load)."""
+        if text not in self.sounds:
+            path = self.path(text)
+            if not os.path.exists(path):
+                return None
+            try:
+                self.sounds[text] = pygame.mixer.Sound(path)
+            except Exception as e:
+                print(f"Could not load cached phrase {path}: {e}")
+                return None
+        return self.sounds[text]
+
+
+class AudioPlayer:
+    """Plays preloaded clips and cached phrases, one at a time, from a background thread.
+
+    play() and say() only queue: the audio starts once the items ahead of it
+    have finished. Detection items still waiting after `max_age` seconds are
+    dropped, so a slow queue never announces what was in front of the camera a
+    while ago. say() needs a PhraseCache (`speech`).
+    """
+
+    def __init__(self, clips=DENOMINATION_CLIPS, cooldown=3.0, max_age=2.0, directory=CLIP_DIR,
+                 speech=None):
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        self.cooldown = cooldown
+        self.max_age = max_age
+        self.speech = speech
+        self.sounds = {}
+        for label, filename in clips.items():
+            path = os.path.join(directory, filename)
+            try:
+                self.sounds[label] = pygame.mixer.Sound(path)
+            except Exception as e:
+                print(f"Could not load audio clip {path}: {e}")
+        self.last_played = {}   # (kind, label or text) -> time it last started
+        self.pending = set()    # (kind, label or text) waiting in the queue
+        self.played = 0
+        self.synthesized = 0    # phrases that had to be rendered when they were said
+        self.skipped = 0        # coalesced, in cooldown or too old
+        self._closing = False
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        self._queue = queue.PriorityQueue()
+        self._thread = threading.Thread(target=self._play_loop, daemon=True)
+        self._thread.start()
+
+    def has_clip(self, label):
+        return label in self.sounds
+
+    def play(self, label, priority=PRIORITY_DETECTION, on_start=None, on_done=None):
+        """Queue the clip for `label`; returns False if there is no such clip.
+
+        `on_start`/`on_done` run on the audio thread around the clip (e.g. to
+        drive an LED while it plays). A request that is coalesced or in
+        cooldown is dropped without calling them.
+        """
+        if label not in self.sounds:
+            return False
+        self._put("clip", label, priority, on_start, on_done)
+        return True
+
+    def say(self, text, priority=PRIORITY_SYSTEM):
+        """Queue a spoken phrase (rendered and cached first if it is new)."""
+        self._put("say", text, priority)
+
+    def prerender(self, texts):
+        """Render phrases that will be said later, in small jobs while the queue is idle.
+
+        A phrase said before its job ran is rendered when it is said, as usual.
+        """
+        texts = list(texts)
+        for start in range(0, len(texts), RENDER_CHUNK):
+            self._queue.put((PRIORITY_RENDER, next(self._order), time.time(), "render",
+                             texts[start:start + RENDER_CHUNK], None, None))
+
+    def close(self):
+        """Stop the audio thread once everything already queued has played.
+
+        Pre-render jobs still waiting are skipped.
+        """
+        self._closing = True
+        self._queue.put((PRIORITY_STOP, next(self._order), 0.0, "stop", None, None, None))
+        self._thread.join(timeout=10.0)
+
+    def _put(self, kind, key, priority, on_start=None, on_done=None):
+        with self._lock:
+            recent = time.time() - self.last_played.get((kind, key), 0.0) < self.cooldown
+            if (kind, key) in self.pending or (recent and priority != PRIORITY_SYSTEM):
+                self.skipped += 1
+                return
+            self.pending.add((kind, key))
+        self._queue.put((priority, next(self._order), time.time(), kind, key, on_start, on_done))
+
+    def _sound(self, kind, key):
+        if kind == "clip":
+            return self.sounds[key]
+        sound = self.speech.sound(key)
+        if sound is None:
+            # Unseen text: render it now (this is the only synthesis on the hot path)
+            self.speech.render([key])
+            self.synthesized += 1
+            sound = self.speech.sound(key)
+        return sound
+
+    def _play_loop(self):
+        while True:
+            priority, _, queued_at, kind, key, on_start, on_done = self._queue.get()
+            if kind == "stop":
+                break
+            if kind == "render":
+                if self._closing:
+                    continue
+                try:
+                    self.speech.render(key)
+                except Exception as e:
+                    print(f"Error rendering phrases: {e}")
+                continue
+            with self._lock:
+                self.pending.discard((kind, key))
+                if priority != PRIORITY_SYSTEM and time.time() - queued_at > self.max_age:
+                    self.skipped += 1
+                    continue
+                self.last_played[(kind, key)] = time.time()
+            try:
+                if on_start:
+                    on_start()
+                sound = self._sound(kind, key)
+                if sound is None:
+                    # Could not render (engine can't write files): speak it live
+                    self.speech.engine.say(key)
+                    self.speech.engine.runAndWait()
+                else:
+                    sound.play()
+                    # Sleep for the clip's length instead of polling the mixer
+                    time.sleep(sound.get_length())
+                self.played += 1
+            except Exception as e:
+                print(f"Error playing audio: {e}")
+            finally:
+                if on_done:
+                    on_done()
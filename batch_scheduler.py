@@ -0,0 +1,103 @@
+import asyncio
+
+
+class BatchScheduler:
+    """Collect pending frames from all connections per mode and run them as one batched call.
+
+    Each mode gets its own queue and collector task. The collector waits for the
+    first frame, then keeps gathering frames for at most `max_wait_ms` (or until
+    `max_batch_size` frames are queued) and hands the whole batch to `run_batch`.
+    Every caller awaits its own future, so results are routed back to the socket
+    that submitted the frame.
+
+    At most `max_concurrent_batches` batches (across all modes) are in flight at
+    once, which should match the size of the executor running them. While all
+    slots are busy, frames keep accumulating and the next batch gets larger.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10, max_concurrent_batches=1):
+        # async run_batch(mode, items) -> list of results, one per item, in order
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._slots = asyncio.Semaphore(max(1, int(max_concurrent_batches)))
+        self._queues = {}
+        self._tasks = {}
+        self._inflight = set()
+
+    async def submit(self, mode, item):
+        """Queue one item for `mode` and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._get_queue(mode).put_nowait((item, future))
+        return await future
+
+    def queue_depth(self, mode):
+        """Items of `mode` waiting to be collected into a batch."""
+        queue = self._queues.get(mode)
+        return queue.qsize() if queue is not None else 0
+
+    def inflight_batches(self):
+        """Batches handed to run_batch and not finished yet."""
+        return len(self._inflight)
+
+    def _get_queue(self, mode):
+        queue = self._queues.get(mode)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[mode] = queue
+            self._tasks[mode] = asyncio.create_task(self._collect(mode, queue))
+        return queue
+
+    async def _collect(self, mode, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            # Top up with whatever arrived while we waited for a free slot
+            while len(batch) < self.max_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            # Callers that disconnected while waiting don't need a result
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.create_task(self._dispatch(mode, batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, mode, batch):
+        try:
+            results = await self.run_batch(mode, [item for item, _ in batch])
+        except Exception as e:
+            print(f"Batch error ({mode}, {len(batch)} frames): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """Stop all collector tasks and in-flight batches."""
+        tasks = list(self._tasks.values()) + list(self._inflight)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queues.clear()
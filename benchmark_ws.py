@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import cv2
+import numpy as np
+import websockets
+
+from geometry import fit_to_input
+from session_recording import KIND_JPEG, SessionReader
+from ws_protocol import decode_results, pack_frame
+
+# Load test for /ws/detect: N simulated wearables stream JPEG frames the way
+# client_wearable.py does (pipelined frame ids, ingest/format/tracking commands,
+# button-style mode switches) and the tool reports throughput, latency
+# percentiles and dropped frames, optionally as JSON for comparing releases.
+#
+#   # against a running server
+#   python benchmark_ws.py --clients 8 --duration 30 --output results.json
+#
+#   # fully offline: start a server with the stub model backend (no .pt files)
+#   python benchmark_ws.py --serve-stub --clients 8 --duration 30
+#
+#   # replay a session recorded by client_wearable.py, at its original pace
+#   python benchmark_ws.py --session sessions/walk1 --replay-speed 1
+#
+# The stub's simulated cost is set with STUB_BATCH_MS / STUB_FRAME_MS.
+
+MODE_CYCLE = ["currency", "object", "both"]
+PERCENTILES = (50, 90, 95, 99)
+
+# -------------------- Frames --------------------
+def synthetic_frames(count, size):
+    """Frames with a moving bright block over noise, so hashes and labels vary."""
+    w, h = size
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = rng.integers(0, 80, (h, w, 3), dtype=np.uint8)
+        x = int((i / count) * (w - w // 4))
+        frame[h // 3:h // 3 + h // 4, x:x + w // 4] = 40 + (i * 37) % 200
+        frames.append(frame)
+    return frames
+
+def load_frames(directory, limit):
+    paths = sorted(p for p in glob.glob(os.path.join(directory, "*"))
+                   if p.lower().endswith((".jpg", ".jpeg", ".png")))[:limit]
+    frames = [f for f in (cv2.imread(p) for p in paths) if f is not None]
+    if not frames:
+        raise SystemExit(f"No images found in {directory}")
+    return frames
+
+def load_session(path, limit):
+    """Frames of a recorded session: JPEG records are sent exactly as recorded,
+    raw records are encoded like synthetic frames. Returns (source, offsets)."""
+    reader = SessionReader(path)
+    count = min(len(reader), limit) if limit else len(reader)
+    if not count:
+        raise SystemExit(f"Session {path} has no frames")
+    offsets = reader.timestamps()[:count]
+    if reader.entry(0)["kind"] == KIND_JPEG:
+        return {"payloads": [reader.jpeg(i) for i in range(count)]}, offsets
+    # Raw frames stay memory-mapped until they are encoded
+    return {"frames": [reader.frame(i) for i in range(count)]}, offsets
+
+def encode_frames(frames, input_size, quality):
+    """Pre-encode every frame like the wearable does: shrunk to the model input size."""
+    encoded = []
+    for frame in frames:
+        small = fit_to_input(frame, input_size) if input_size else frame
+        jpeg = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        encoded.append((jpeg, (frame.shape[1], frame.shape[0])))
+    return encoded
+
+# -------------------- Simulated wearable --------------------
+class ClientStats:
+    def __init__(self):
+        self.sent = 0
+        self.answered = 0
+        self.errors = 0
+        self.timed_out = 0
+        self.server_dropped = 0
+        self.mode_switches = 0
+        self.latencies = {}  # mode -> [seconds]
+
+async def run_client(index, args, source, stop_at):
+    """One wearable: pipelined sender plus receiver, until `stop_at`."""
+    stats = ClientStats()
+    async with websockets.connect(args.url, max_size=None) as websocket:
+        hello = json.loads(await websocket.recv())
+        modes = hello["modes"]
+        await websocket.send(f"INGEST:{args.ingest}")
+        await websocket.send(f"FORMAT:{args.format}")
+        await websocket.send(f"TRACK:{'on' if args.tracking else 'off'}")
+
+        cycle = [m for m in MODE_CYCLE if m in hello["classes"]] or list(hello["classes"])
+        # Spread clients over the modes so every model gets traffic
+        state = {"mode": cycle[index % len(cycle)]}
+        await websocket.send(f"MODE:{state['mode']}")
+        if "payloads" in source:
+            encoded = {mode: source["payloads"] for mode in cycle}
+        else:
+            encoded = {mode: encode_frames(source["frames"],
+                                           hello["input_sizes"].get(mode) if args.shrink else None,
+                                           args.quality)
+                       for mode in cycle}
+        count = len(encoded[cycle[0]])
+        offsets = source.get("offsets")
+
+        slots = asyncio.Semaphore(args.pipeline_depth)
+        pending = {}  # frame_id -> (send time, mode)
+
+        def release(frame_id):
+            if pending.pop(frame_id, None) is not None:
+                slots.release()
+
+        async def sender():
+            frame_id = 0
+            next_switch = time.time() + args.switch_every if args.switch_every else None
+            interval = 1.0 / args.fps if args.fps else 0.0
+            started = time.time()
+            while time.time() < stop_at:
+                try:
+                    await asyncio.wait_for(slots.acquire(), args.timeout)
+                except asyncio.TimeoutError:
+                    # Same as the wearable: give up on the oldest unanswered frame
+                    if pending:
+                        stats.timed_out += 1
+                        release(min(pending))
+                    continue
+
+                if next_switch and time.time() >= next_switch:
+                    state["mode"] = cycle[(cycle.index(state["mode"]) + 1) % len(cycle)]
+                    await websocket.send(f"MODE:{state['mode']}")
+                    stats.mode_switches += 1
+                    next_switch += args.switch_every
+
+                if offsets is not None and args.replay_speed:
+                    # Keep the recording's timing; later laps continue after the last frame
+                    lap, position = divmod(frame_id, count)
+                    recorded = lap * (offsets[-1] + 1 / 30) + offsets[position]
+                    await asyncio.sleep(max(0.0, started + recorded / args.replay_speed - time.time()))
+
+                jpeg, source_size = encoded[state["mode"]][frame_id % count]
+                pending[frame_id] = (time.perf_counter(), state["mode"])
+                await websocket.send(pack_frame(frame_id, jpeg, source_size))
+                stats.sent += 1
+                frame_id += 1
+                await asyncio.sleep(interval)
+
+        async def receiver():
+            while True:
+                message = await websocket.recv()
+                received = time.perf_counter()
+                if isinstance(message, bytes):
+                    frame_id, mode_index, dropped, _ = decode_results(message)
+                    data = {"frame_id": frame_id, "mode": modes[mode_index], "dropped": dropped}
+                else:
+                    data = json.loads(message)
+                    if "event" in data:
+                        continue
+                stats.server_dropped = max(stats.server_dropped, data.get("dropped", 0))
+                frame_id = data.get("frame_id")
+                entry = pending.get(frame_id)
+                if entry is None:
+                    continue
+                # Older frames still pending were skipped by the server
+                for stale in [i for i in pending if i < frame_id]:
+                    release(stale)
+                release(frame_id)
+                if "error" in data:
+                    stats.errors += 1
+                    continue
+                sent_at, mode = entry
+                stats.answered += 1
+                stats.latencies.setdefault(data.get("mode", mode), []).append(received - sent_at)
+
+        receive_task = asyncio.create_task(receiver())
+        try:
+            await sender()
+            # Let the last replies arrive
+            deadline = time.time() + args.timeout
+            while pending and time.time() < deadline:
+                await asyncio.sleep(0.01)
+        finally:
+            receive_task.cancel()
+            await asyncio.gather(receive_task, return_exceptions=True)
+    return stats
+
+# -------------------- Report --------------------
+def summarize(latencies):
+    if not latencies:
+        return None
+    ms = np.array(latencies) * 1000
+    summary = {f"p{p}": round(float(np.percentile(ms, p)), 2) for p in PERCENTILES}
+    summary.update(mean=round(float(ms.mean()), 2), max=round(float(ms.max()), 2), count=len(ms))
+    return summary
+
+def build_report(args, all_stats, elapsed, connect_failures):
+    latencies, by_mode = [], {}
+    for stats in all_stats:
+        for mode, values in stats.latencies.items():
+            latencies.extend(values)
+            by_mode.setdefault(mode, []).extend(values)
+    sent = sum(s.sent for s in all_stats)
+    answered = sum(s.answered for s in all_stats)
+    errors = sum(s.errors for s in all_stats)
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "duration_s": round(elapsed, 2),
+        "clients": args.clients,
+        "connect_failures": connect_failures,
+        "frames_sent": sent,
+        "frames_answered": answered,
+        "frames_errored": errors,
+        # Sent but never answered: skipped by the server (latest ingest) or timed out
+        "frames_dropped": sent - answered - errors,
+        "server_reported_dropped": sum(s.server_dropped for s in all_stats),
+        "timed_out": sum(s.timed_out for s in all_stats),
+        "mode_switches": sum(s.mode_switches for s in all_stats),
+        "throughput_fps": round(answered / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "latency_ms_by_mode": {mode: summarize(values) for mode, values in by_mode.items()},
+    }
+
+def print_report(report):
+    print(f"\n{report['clients']} clients, {report['duration_s']} s "
+          f"({report['connect_failures']} failed to connect)")
+    print(f"  sent {report['frames_sent']}, answered {report['frames_answered']}, "
+          f"dropped {report['frames_dropped']}, errors {report['frames_errored']}, "
+          f"timed out {report['timed_out']}")
+    print(f"  throughput {report['throughput_fps']} frames/s, mode switches {report['mode_switches']}")
+    rows = [("all", report["latency_ms"])] + list(report["latency_ms_by_mode"].items())
+    print(f"  {'latency ms':12s}" + "".join(f"{k:>9s}" for k in ["p50", "p90", "p95", "p99", "mean", "max"]))
+    for name, summary in rows:
+        if summary:
+            print(f"  {name:12s}" + "".join(f"{summary[k]:9.1f}"
+                                            for k in ["p50", "p90", "p95", "p99", "mean", "max"]))
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+# -------------------- Stub server --------------------
+def start_stub_server(port):
+    """Run server_inference with the stub backend in a subprocess and wait until it's ready."""
+    env = dict(os.environ, INFERENCE_BACKEND="stub")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "server_inference:app",
+                               "--port", str(port), "--log-level", "warning"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("Stub server exited during startup")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except Exception:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("Stub server did not become ready")
+
+async def run(args, source):
+    stop_at = time.time() + args.duration
+    start = time.time()
+    results = await asyncio.gather(*[run_client(i, args, source, stop_at) for i in range(args.clients)],
+                                   return_exceptions=True)
+    elapsed = time.time() - start
+    stats = [r for r in results if isinstance(r, ClientStats)]
+    for error in (r for r in results if not isinstance(r, ClientStats)):
+        print(f"Client failed: {error!r}")
+    return build_report(args, stats, elapsed, len(results) - len(stats))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /ws/detect websocket")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws/detect")
+    parser.add_argument("--clients", type=int, default=4, help="simulated wearables")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of streaming")
+    parser.add_argument("--frames", help="directory of images to send (default: synthetic)")
+    parser.add_argument("--session", help="recorded session to replay (see session_recording.py)")
+    parser.add_argument("--replay-speed", type=float, default=0,
+                        help="with --session: 1 = recorded pace, 2 = twice as fast, 0 = no pacing")
+    parser.add_argument("--max-frames", type=int, default=100)
+    parser.add_argument("--frame-size", default="1280x720", help="synthetic capture size WxH")
+    parser.add_argument("--fps", type=float, default=0, help="per-client send rate cap (0 = no cap)")
+    parser.add_argument("--pipeline-depth", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds before a frame counts as lost")
+    parser.add_argument("--ingest", choices=["fifo", "latest"], default="latest")
+    parser.add_argument("--format", choices=["json", "binary"], default="binary")
+    parser.add_argument("--tracking", action="store_true")
+    parser.add_argument("--switch-every", type=float, default=10.0,
+                        help="seconds between mode switches per client (0 = never)")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality")
+    parser.add_argument("--no-shrink", dest="shrink", action="store_false",
+                        help="send full-size frames instead of shrinking to the model input size")
+    parser.add_argument("--serve-stub", action="store_true",
+                        help="start a local server with the stub model backend")
+    parser.add_argument("--port", type=int, default=8765, help="port for --serve-stub")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    if args.session:
+        source, offsets = load_session(args.session, args.max_frames)
+        source["offsets"] = offsets
+    elif args.frames:
+        source = {"frames": load_frames(args.frames, args.max_frames)}
+    else:
+        w, h = (int(v) for v in args.frame_size.split("x"))
+        source = {"frames": synthetic_frames(min(args.max_frames, 60), (w, h))}
+
+    server = None
+    if args.serve_stub:
+        args.url = f"ws://127.0.0.1:{args.port}/ws/detect"
+        server = start_stub_server(args.port)
+    try:
+        report = asyncio.run(run(args, source))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
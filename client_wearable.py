@@ -1,19 +1,74 @@
 import cv2
 import time
 import asyncio
+import itertools
 import websockets
 import json
-import threading
+import urllib.request
 import pygame
 import pyttsx3
 import numpy as np
 from picamera2 import Picamera2
 from gpiozero import Button
 
+from adaptive_encoder import AdaptiveEncoder
+from audio_feedback import PRIORITY_DETECTION, PRIORITY_SYSTEM, AudioPlayer, PhraseCache
+from edge_offload import SERVER, LocalDetector, OffloadScheduler
+from frame_capture import CameraCapture
+from frame_gate import FrameGate
+from session_recording import SessionRecorder
+from ws_protocol import decode_results, pack_frame, records_to_detections
+
 # -------------------- Configuration --------------------
 SERVER_IP = "172.20.10.3"  # REPLACE with your Laptop's IP Address
 SERVER_PORT = 8000
 WS_URL = f"ws://{SERVER_IP}:{SERVER_PORT}/ws/detect"
+READY_URL = f"http://{SERVER_IP}:{SERVER_PORT}/readyz"
+# Frames sent but not yet answered. 1 = strict lock-step (send -> wait reply);
+# 2-3 hides the network round trip behind the next capture/encode.
+PIPELINE_DEPTH = 2
+# Give up on a frame whose reply hasn't arrived after this many seconds
+RESPONSE_TIMEOUT = 2.0
+# "latest": the server skips frames that queue up behind a slow inference so results
+# always describe the current scene. "fifo": every frame is processed in order.
+INGEST_MODE = "latest"
+# "binary": fixed-size result records, no JSON parsing on the Pi. "json": readable results.
+RESULT_FORMAT = "binary"
+# Let the server run the detector on every few frames only and track boxes in
+# between; stable track ids mean each object is announced once, not every frame.
+TRACKING = True
+# Skip frames before encoding when they are motion-blurred or show the same scene
+# as the last frame sent. Set GATE_ENABLED = False to send every frame.
+GATE_ENABLED = True
+GATE_MIN_SHARPNESS = 60.0     # Laplacian variance on a 160x120 gray copy
+GATE_MIN_CHANGE_BITS = 6      # dHash bits (of 64) that must differ from the last sent frame
+GATE_MAX_SKIP_SECONDS = 2.0   # always send at least this often
+GATE_STATS_EVERY = 200        # print gate counters every N captured frames
+# JPEG quality and downscale adapt to the measured round trip to stay near the target
+TARGET_RTT = 0.25             # seconds from send to reply
+JPEG_QUALITY_RANGE = (35, 80)
+MIN_SCALE = 0.5               # never send less than half the model input size
+# Record the session for replay (session_recording.py): set RECORD_PATH, e.g. "sessions/walk1".
+# "jpeg" keeps the encoded frames exactly as sent; "raw" keeps every captured
+# frame before gating and encoding (much larger). Server replies are always kept.
+RECORD_PATH = None
+RECORD_STORE = "jpeg"
+# The same denomination clip isn't repeated within this many seconds
+AUDIO_COOLDOWN = 3.0
+# Edge/offload (edge_offload.py): while the server is unreachable, or its round
+# trip is slower than the small local models, frames are answered on the Pi.
+# The server keeps getting a probe frame every PROBE_INTERVAL seconds, and
+# detection moves back to it once it answers faster again. A lost connection is
+# retried with exponential backoff between RECONNECT_BACKOFF seconds.
+LOCAL_FALLBACK = True
+LOCAL_MODELS = {"currency": "./best.pt", "object": "./obj1.pt"}
+LOCAL_COMBINED = {"both": ["currency", "object"]}
+LOCAL_QUANTIZED_MODES = set()  # INT8 models from quantize_models.py, e.g. {"currency"}
+LOCAL_THRESHOLD = 0.5
+SWITCH_TO_LOCAL_RATIO = 1.3   # server round trip above 1.3x local inference -> local
+SWITCH_TO_SERVER_RATIO = 0.9  # probes below 0.9x local inference -> back to the server
+PROBE_INTERVAL = 1.0
+RECONNECT_BACKOFF = (1.0, 30.0)
 
 # -------------------- Audio Setup --------------------
 pygame.init()
@@ -21,28 +76,14 @@ pygame.mixer.init()
 
 engine = pyttsx3.init()
 engine.setProperty('rate', 130)
-speak_lock = threading.Lock()
-
-def speak(text):
-    """Speak text safely from a separate thread."""
-    def _speak():
-        with speak_lock:
-            engine.say(text)
-            engine.runAndWait()
-    threading.Thread(target=_speak, daemon=True).start()
-
-def play_audio_file(filename):
-    """Play an MP3 file safely."""
-    def _play():
-        if not pygame.mixer.music.get_busy():
-            try:
-                pygame.mixer.music.load(filename)
-                pygame.mixer.music.play()
-                while pygame.mixer.music.get_busy():
-                    time.sleep(0.1)
-            except Exception as e:
-                print(f"Error playing audio: {e}")
-    threading.Thread(target=_play, daemon=True).start()
+
+# Denomination clips are decoded once and phrases synthesized once (cached under
+# tts_cache/); both are played by one audio thread, so speaking never blocks
+audio = AudioPlayer(cooldown=AUDIO_COOLDOWN, speech=PhraseCache(engine))
+
+def speak(text, priority=PRIORITY_SYSTEM):
+    """Queue text to be spoken (from the phrase cache when it was said before)."""
+    audio.say(text, priority)
 
 # -------------------- Camera Setup (PRESERVED) --------------------
 picam2 = Picamera2()
@@ -59,6 +100,13 @@ try:
 except Exception as e:
     print(f"Warning: Camera preview config failed (headless?): {e}")
     # Fallback to no preview if needed, or just proceed if it's just a display error
+
+# Frames are captured on their own thread into a small ring; the sender takes the
+# newest one without copying. Frames hold their slot until their reply has been
+# drawn (PIPELINE_DEPTH of them, plus one being shown while the next is sent,
+# plus one in local inference), and two more slots keep one frame being written
+# and one ready to send.
+capture = CameraCapture(picam2, slots=PIPELINE_DEPTH + 4)
     
 # -------------------- Button & State --------------------
 BUTTON_PIN = 26
@@ -68,12 +116,18 @@ except Exception as e:
     print(f"Button init failed (not on Pi?): {e}")
     button = None
 
+# The button cycles through these; "both" runs the currency and object models together
+MODE_CYCLE = ["currency", "object", "both"]
+audio.prerender(["Connected to server", "Using server detection", "Server unavailable",
+                 "Server unavailable, using on-device detection",
+                 "Server slow, using on-device detection"]
+                + [f"Switched to {mode} mode" for mode in MODE_CYCLE])
 current_mode = "currency"
 mode_changed = False
 
 def toggle_mode():
     global current_mode, mode_changed
-    current_mode = "object" if current_mode == "currency" else "currency"
+    current_mode = MODE_CYCLE[(MODE_CYCLE.index(current_mode) + 1) % len(MODE_CYCLE)]
     mode_changed = True
     print(f"Button pressed! Switching to {current_mode}...")
     speak(f"Switched to {current_mode} mode")
@@ -81,97 +135,400 @@ def toggle_mode():
 if button:
     button.when_pressed = toggle_mode
 
-# -------------------- Main Loop --------------------
-async def send_frames():
-    global mode_changed
+# -------------------- Edge / Offload --------------------
+scheduler = OffloadScheduler(SWITCH_TO_LOCAL_RATIO, SWITCH_TO_SERVER_RATIO, PROBE_INTERVAL,
+                             RECONNECT_BACKOFF)
+quit_requested = None  # asyncio.Event, set when the user presses 'q'
+
+def announce_target(target):
+    if target == SERVER:
+        # No replies yet: this switch is a fresh connection, not a recovery
+        speak("Connected to server" if scheduler.server_samples == 0 else "Using server detection")
+    elif not LOCAL_FALLBACK:
+        speak("Server unavailable")
+    elif scheduler.connected:
+        speak("Server slow, using on-device detection")
+    else:
+        speak("Server unavailable, using on-device detection")
+
+scheduler.on_switch = announce_target
+
+# -------------------- Feedback --------------------
+announced_tracks = set()  # track ids already spoken in the current mode
+
+def handle_detections(frame, data):
+    """Announce the top detection and draw all boxes onto the frame that produced them.
+
+    Tracked detections are announced once per track id. In the combined mode
+    each detection carries the model it came from as "source".
+    """
+    detections = data.get("detections", [])
+    server_mode = data.get("mode", "currency")
     
-    print(f"Connecting to {WS_URL}...")
-    async with websockets.connect(WS_URL) as websocket:
-        print("Connected to Server!")
-        speak("Connected to server")
+    # Feedback Logic
+    if detections:
+        # Sort by score
+        detections.sort(key=lambda x: x["score"], reverse=True)
+        top_result = detections[0]
+        track_id = top_result.get("track_id")
+        
+        # Log top result
+        print(f"Detected: {top_result['label']} ({top_result['score']:.2f})")
         
+        # With tracking on, each object is announced once instead of on every frame
+        if track_id is None or track_id not in announced_tracks:
+            if track_id is not None:
+                announced_tracks.add(track_id)
+
+            # Denominations play their clip (queued, coalesced and rate limited per label)
+            if top_result.get("source", server_mode) == "currency" and audio.has_clip(top_result['label']):
+                audio.play(top_result['label'])
+            else:
+                speak(top_result['label'], PRIORITY_DETECTION)
+
+    # -------------------- VISUALIZATION --------------------
+    # Draw boxes for all detections
+    for det in detections:
+        x1, y1, x2, y2 = det["box"]
+        label = det["label"]
+        score = det["score"]
+        
+        # Draw Rectangle
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+        
+        # Draw Text
+        text = f"{label} {score:.2f}"
+        cv2.putText(frame, text, (int(x1), int(y1) - 10), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+# -------------------- Main Loop --------------------
+# Frame ids keep counting across reconnects and include frames answered locally,
+# so every frame and reply in a recorded session has its own id
+frame_ids = itertools.count()
+
+class FrameWindow:
+    """Frames sent to the server and still waiting for a reply, keyed by frame id."""
+
+    def __init__(self, depth):
+        self.slots = asyncio.Semaphore(depth)
+        self.pending = {}  # frame_id -> (frame, send_time, payload_bytes, capture seq)
+        self.closed = False
+
+    async def reserve(self):
+        """Wait for a free slot, expiring the oldest frame if its reply is overdue."""
         while True:
-            # 1. Capture Frame
-            frame = picam2.capture_array()
-            
-            # 2. Encode to JPEG
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            bytes_data = buffer.tobytes()
-            
-            # 3. Check for Mode Change
-            if mode_changed:
-                await websocket.send(f"MODE:{current_mode}")
-                mode_changed = False
-            
-            # 4. Send Frame
-            await websocket.send(bytes_data)
-            
-            # 5. Receive Results (Non-blocking wait for response? No, we wait for inference)
-            # Depending on latency, we might want to send/receive concurrently. 
-            # For simplicity, strict step-lock (Send -> Wait Reply) ensures we don't flood.
             try:
-                response = await websocket.recv()
+                await asyncio.wait_for(self.slots.acquire(), RESPONSE_TIMEOUT)
+                return
+            except asyncio.TimeoutError:
+                if self.pending:
+                    oldest = min(self.pending)
+                    print(f"No reply for frame {oldest}, dropping it")
+                    self._release(oldest)
+                    # Counts as a very slow reply, so a stalled server hands over to local inference
+                    scheduler.record_server(RESPONSE_TIMEOUT)
+
+    def unreserve(self):
+        """Give back a slot that was reserved for a frame we decided not to send."""
+        self.slots.release()
+
+    def add(self, frame, payload_bytes, seq):
+        frame_id = next(frame_ids)
+        self.pending[frame_id] = (frame, time.time(), payload_bytes, seq)
+        return frame_id
+
+    def complete(self, frame_id):
+        """Return the pending entry a reply belongs to, or None for unknown/expired ids.
+
+        The caller releases the returned frame's capture slot once it is done with it.
+        """
+        entry = self.pending.get(frame_id)
+        if entry is None:
+            return None
+        # Older frames still pending were skipped by the server or overtaken
+        for stale_id in [i for i in self.pending if i < frame_id]:
+            self._release(stale_id)
+        self.pending.pop(frame_id)
+        self.slots.release()
+        return entry
+
+    def release_all(self):
+        """Give back the capture slots of frames that will never get a reply."""
+        for frame_id in list(self.pending):
+            self._release(frame_id)
+
+    def _release(self, frame_id):
+        entry = self.pending.pop(frame_id, None)
+        if entry is not None:
+            capture.release(entry[3])
+            self.slots.release()
+
+async def sender(websocket, window, encoder, server_info, recorder=None):
+    """Capture, encode and send frames while up to PIPELINE_DEPTH are in flight.
+
+    Frames are shrunk to the current mode's model input size before encoding and
+    sent with their captured size, so the server replies in capture coordinates.
+    While the scheduler runs inference locally only a probe frame is sent now
+    and then, to keep measuring the server's round trip.
+    """
+    global mode_changed
+
+    gate = FrameGate(GATE_MIN_SHARPNESS, GATE_MIN_CHANGE_BITS, GATE_MAX_SKIP_SECONDS)
+    captured = 0
+    seq = -1
+    while True:
+        await window.reserve()
+        # wait_for() can swallow a cancel that races with the acquire, so check explicitly
+        if window.closed:
+            return
+
+        # 1. Take the newest captured frame (a view into the capture ring, no copy)
+        seq, frame, captured_at = await capture.next_frame(seq)
+        captured += 1
+        if captured % GATE_STATS_EVERY == 0:
+            print(f"Frame gate: {gate.stats()}, encoder: {encoder.stats()}, "
+                  f"capture: {capture.stats()}")
+        
+        # 2. Check for Mode Change (the next frame must reach the new model)
+        if mode_changed:
+            await websocket.send(f"MODE:{current_mode}")
+            mode_changed = False
+            gate.reset()
+            announced_tracks.clear()
+
+        # 3. Answering locally: only send a probe (ungated) every PROBE_INTERVAL
+        probing = not scheduler.use_server()
+        if probing and not scheduler.should_probe():
+            capture.release(seq)
+            window.unreserve()
+            await asyncio.sleep(0.05)
+            continue
+
+        # 4. Skip blurred or unchanged frames before paying for the encode
+        if not probing and GATE_ENABLED and not gate.check(frame)[0]:
+            if recorder and RECORD_STORE == "raw":
+                recorder.record_raw(frame, -1, captured_at)
+            capture.release(seq)
+            window.unreserve()
+            await asyncio.sleep(0.01)
+            continue
+        
+        # 5. Encode to JPEG at no more than the model's input size
+        #    (quality and scale follow the measured round trip)
+        jpeg = encoder.encode(frame, server_info["input_sizes"].get(current_mode))
+        
+        # 6. Send Frame (tagged with its id so the reply can be matched)
+        frame_id = window.add(frame, len(jpeg), seq)
+        source_size = (frame.shape[1], frame.shape[0])
+        await websocket.send(pack_frame(frame_id, jpeg, source_size))
+        if recorder:
+            if RECORD_STORE == "raw":
+                recorder.record_raw(frame, frame_id, captured_at)
+            else:
+                recorder.record_jpeg(jpeg, source_size, frame_id, captured_at)
+        
+        # Optional: Limit FPS if needed
+        await asyncio.sleep(0.01)
+
+async def receiver(websocket, window, encoder, server_info, recorder=None):
+    """Match replies to their frames and give feedback. Returns when the user quits."""
+    dropped = 0
+    modes, classes = server_info["modes"], server_info["classes"]
+    sources = server_info.get("sources", {})
+    while True:
+        response = await websocket.recv()
+        try:
+            if isinstance(response, bytes):
+                frame_id, mode_index, server_dropped, records = decode_results(response)
+                server_mode = modes[mode_index]
+                data = {"frame_id": frame_id, "mode": server_mode, "dropped": server_dropped,
+                        "detections": records_to_detections(records, classes[server_mode],
+                                                            sources.get(server_mode))}
+            else:
                 data = json.loads(response)
-                
-                detections = data.get("detections", [])
-                server_mode = data.get("mode", "currency")
-                
-                # Feedback Logic
-                if detections:
-                    # Sort by score
-                    detections.sort(key=lambda x: x["score"], reverse=True)
-                    top_result = detections[0]
-                    
-                    # Log top result
-                    print(f"Detected: {top_result['label']} ({top_result['score']:.2f})")
-                    
-                    # Update Audio Feedback (Rate Limiting handling is implicit via get_busy() in play_audio_file and speaking logic)
-                    if server_mode == "currency":
-                         if top_result['label'] in ['10', '20', '50', '100', '500']:
-                             play_audio_file(f"{top_result['label']}.mp3")
-                         else:
-                             speak(top_result['label'])
-                    else:
-                        speak(top_result['label'])
-
-                # -------------------- VISUALIZATION --------------------
-                # Draw boxes for all detections
-                for det in detections:
-                    x1, y1, x2, y2 = det["box"]
-                    label = det["label"]
-                    score = det["score"]
-                    
-                    # Draw Rectangle
-                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                    
-                    # Draw Text
-                    text = f"{label} {score:.2f}"
-                    cv2.putText(frame, text, (int(x1), int(y1) - 10), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                if "event" in data:
+                    print(f"Server event: {data}")
+                    if data["event"] == "mode_unavailable":
+                        speak(f"{data['mode']} mode is not available")
+                    continue
+
+            if data.get("dropped", 0) > dropped:
+                dropped = data["dropped"]
+                print(f"Server dropped {dropped} stale frames so far")
+
+            if recorder and data.get("frame_id") is not None:
+                recorder.record_response(data["frame_id"], data)
+
+            entry = window.complete(data.get("frame_id"))
+            if entry is None:
+                continue
+            frame, sent_at, payload_bytes, seq = entry
+            encoder.record(time.time() - sent_at, payload_bytes)
+            scheduler.record_server(time.time() - sent_at)
+            if not scheduler.use_server():
+                # A probe: local inference is giving the feedback
+                capture.release(seq)
+                continue
+
+            try:
+                handle_detections(frame, data)
 
                 # Show Frame locally on the Pi
                 cv2.imshow("Wearable View", frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                        
-            except websockets.exceptions.ConnectionClosed:
-                print("Connection closed")
-                break
-            except Exception as e:
-                print(f"Loop Error: {e}")
-                
-            # Optional: Limit FPS if needed
-            await asyncio.sleep(0.01)
+            finally:
+                capture.release(seq)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                quit_requested.set()
+                return
+        except Exception as e:
+            print(f"Loop Error: {e}")
+
+async def local_inference(detector, recorder=None):
+    """Answer frames with the local models whenever the scheduler picks local inference."""
+    seconds = await asyncio.to_thread(detector.load)
+    if seconds is None:
+        return
+    scheduler.record_local(seconds)
+    local_mode = None
+    seq = -1
+    while True:
+        mode = current_mode
+        if not scheduler.use_local() or not detector.supports(mode):
+            await asyncio.sleep(0.05)
+            continue
+        if mode != local_mode:
+            # Each mode announces its objects afresh, as with the server
+            detector.reset_tracks()
+            announced_tracks.clear()
+            local_mode = mode
+
+        seq, frame, captured_at = await capture.next_frame(seq)
+        try:
+            frame_id = next(frame_ids)
+            if recorder:
+                # Before handle_detections draws on the frame
+                if RECORD_STORE == "raw":
+                    recorder.record_raw(frame, frame_id, captured_at)
+                else:
+                    quality = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY_RANGE[1]]
+                    ok, jpeg = cv2.imencode(".jpg", frame, quality)
+                    if ok:
+                        source_size = (frame.shape[1], frame.shape[0])
+                        recorder.record_jpeg(jpeg, source_size, frame_id, captured_at)
+            start = time.perf_counter()
+            detections = await asyncio.to_thread(detector.detect, frame, mode)
+            scheduler.record_local(time.perf_counter() - start)
+            data = {"frame_id": frame_id, "mode": mode, "detections": detections, "local": True}
+            if recorder:
+                recorder.record_response(frame_id, data)
+            handle_detections(frame, data)
+            cv2.imshow("Wearable View", frame)
+        except Exception as e:
+            print(f"Local inference error: {e}")
+        finally:
+            capture.release(seq)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            quit_requested.set()
+            return
+
+def server_ready():
+    """True once the server reports its models loaded and warmed up."""
+    try:
+        with urllib.request.urlopen(READY_URL, timeout=2) as response:
+            return response.status == 200
+    except Exception:
+        return False  # 503 while warming up, or not reachable yet
+
+async def stream_to_server(recorder=None):
+    """One connection: stream frames until it closes or the user quits."""
+    # Don't stream frames the server can't yet answer at steady-state latency
+    if not await asyncio.to_thread(server_ready):
+        print(f"Server not ready at {READY_URL}")
+        return
+    print(f"Connecting to {WS_URL}...")
+    async with websockets.connect(WS_URL) as websocket:
+        print("Connected to Server!")
 
-    cv2.destroyAllWindows()
+        # The server's first message describes its models: modes, class tables
+        # (for binary results) and input sizes (to shrink frames before encoding)
+        server_info = json.loads(await websocket.recv())
+        # Every label the server can announce, rendered while the audio thread is idle
+        audio.prerender(sorted({name for names in server_info["classes"].values() for name in names}))
+        await websocket.send(f"INGEST:{INGEST_MODE}")
+        await websocket.send(f"FORMAT:{RESULT_FORMAT}")
+        await websocket.send(f"TRACK:{'on' if TRACKING else 'off'}")
+        # A new connection starts in the server's default mode
+        await websocket.send(f"MODE:{current_mode}")
+        # The server's track ids start again at 1 on every connection
+        announced_tracks.clear()
+        scheduler.connected_to_server()
+
+        window = FrameWindow(PIPELINE_DEPTH)
+        encoder = AdaptiveEncoder(TARGET_RTT, JPEG_QUALITY_RANGE[0], JPEG_QUALITY_RANGE[1], MIN_SCALE)
+        tasks = [asyncio.create_task(sender(websocket, window, encoder, server_info, recorder)),
+                 asyncio.create_task(receiver(websocket, window, encoder, server_info, recorder)),
+                 asyncio.create_task(quit_requested.wait())]
+        try:
+            # Stop as soon as either side finishes (user quit or connection closed)
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        except websockets.exceptions.ConnectionClosed:
+            print("Connection closed")
+        finally:
+            window.closed = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            window.release_all()
+
+async def send_frames():
+    """Stream to the server, reconnecting with backoff; fall back to local inference meanwhile."""
+    global quit_requested
+    quit_requested = asyncio.Event()
+    # One recording for the whole run: every connection and the local answers in between
+    recorder = SessionRecorder(RECORD_PATH) if RECORD_PATH else None
+    local_task = None
+    if LOCAL_FALLBACK:
+        detector = LocalDetector(LOCAL_MODELS, LOCAL_COMBINED, quantized_modes=LOCAL_QUANTIZED_MODES,
+                                 threshold=LOCAL_THRESHOLD)
+        # Loaded in the background, so the server isn't kept waiting for the models
+        local_task = asyncio.create_task(local_inference(detector, recorder))
+    try:
+        while not quit_requested.is_set():
+            try:
+                await stream_to_server(recorder)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                print(f"Server connection failed: {e}")
+            if quit_requested.is_set():
+                break
+            scheduler.disconnected()
+            delay = scheduler.next_backoff()
+            print(f"Reconnecting in {delay:.1f}s ({scheduler.stats()})")
+            try:
+                await asyncio.wait_for(quit_requested.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if local_task:
+            local_task.cancel()
+            await asyncio.gather(local_task, return_exceptions=True)
+        if recorder:
+            recorder.close()
+            print(f"Recorded {recorder.written} records to {RECORD_PATH} "
+                  f"({recorder.dropped} dropped)")
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     try:
+        capture.start()
         asyncio.run(send_frames())
     except KeyboardInterrupt:
         print("Stopped by user")
     except Exception as e:
         print(f"Error: {e}")
     finally:
+        capture.stop()
         picam2.stop()
         picam2.close()
+        audio.close()
@@ -1,9 +1,9 @@
-import cv2
-import time
-from ultralytics import YOLO
-from picamera2 import Picamera2
 import RPi.GPIO as GPIO
-import pygame
+
+from local_runtime import LocalRuntime
+
+# Currency detection with an LED on PIN_50 while the 50 note is announced.
+# Capture, inference, drawing and audio run as separate stages (local_runtime.py).
 
 # GPIO setup
 GPIO.setmode(GPIO.BCM)
@@ -14,71 +14,22 @@ GPIO.setup(PIN_100, GPIO.OUT)
 
 # Load YOLO model
 model_path = './best.pt'
-model = YOLO(model_path)
-class_names = model.names
+# Run the INT8 model built by quantize_models.py (if it was accepted)
+USE_INT8 = False
 
 # Detection threshold
 threshold = 0.5
 
-# Initialize PiCamera2
-picam2 = Picamera2()
-picam2.preview_configuration.main.size = (1280, 720)
-picam2.preview_configuration.main.format = "RGB888"
-picam2.preview_configuration.align()
-picam2.configure("preview")
-picam2.start()
-
-# Initialize pygame once
-pygame.init()
-pygame.mixer.init()
+# Clips are played on the audio thread; the LED is lit while the 50 clip plays
+runtime = LocalRuntime({"currency": model_path}, source="camera", size=(1280, 720),
+                       quantized_modes={"currency"} if USE_INT8 else (), threshold=threshold,
+                       window="YOLO Detection", audio=True, clip_labels={'50', '20'},
+                       label_hooks={'50': (lambda: GPIO.output(PIN_50, GPIO.HIGH),
+                                           lambda: GPIO.output(PIN_50, GPIO.LOW))})
 
-# Allow camera to warm up
-time.sleep(0.1)
 print("Starting detection... Press Ctrl+C to stop.")
-
 try:
-    while True:
-        frame = picam2.capture_array()
-        results = model(frame)[0]
-
-        for box in results.boxes.data.tolist():
-            x1, y1, x2, y2, score, class_id = box
-            if score >= threshold:
-                label = class_names[int(class_id)]
-                cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                cv2.putText(frame, f"{label} {score:.2f}", (int(x1), int(y1)-10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-                if label == '50':
-                    GPIO.output(PIN_50, GPIO.HIGH)
-                    if not pygame.mixer.music.get_busy():
-                        pygame.mixer.music.load("50.mp3")
-                        pygame.mixer.music.play()
-                        while pygame.mixer.music.get_busy():
-                            time.sleep(0.1)
-                    GPIO.output(PIN_50, GPIO.LOW)
-
-                elif label == '20':
-                   if not pygame.mixer.music.get_busy():
-                        pygame.mixer.music.load("20.mp3")
-                        pygame.mixer.music.play()
-                        while pygame.mixer.music.get_busy():
-                            time.sleep(0.1)
-
-        # Show the frame (optional if you're using a GUI)
-        cv2.imshow("YOLO Detection", frame)
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-
-except KeyboardInterrupt:
-    print("\nDetection stopped by user.")
-
+    runtime.run()
 finally:
-    # Cleanup
-    cv2.destroyAllWindows()
-    picam2.close()
+    # Cleanup (the runtime has stopped the camera and the audio thread)
     GPIO.cleanup()
-    pygame.mixer.quit()
-    pygame.quit()
-
@@ -0,0 +1,201 @@
+import random
+import threading
+import time
+import numpy as np
+
+from tracker import IoUTracker
+
+# Where the wearable's frames are answered: the server or the Pi itself.
+#
+# The server is faster when the network is good, but a slow link or a busy or
+# missing server turns every frame into seconds of silence. OffloadScheduler
+# keeps an average of the server's round trip (from every reply, and from a
+# probe frame every PROBE_INTERVAL while running locally) and of the local
+# model's inference time, and picks the faster of the two:
+#   server -> local  when the connection is lost, or the server round trip is
+#                    more than `to_local` times the local inference time
+#   local -> server  once connected and probes come back faster than
+#                    `to_server` times the local inference time
+# The gap between the two ratios keeps it from flapping on a jittery link.
+# While disconnected, reconnect attempts back off exponentially (with jitter,
+# so several wearables don't retry in step) and the delay resets on success.
+#
+# LocalDetector runs the same small models as the standalone scripts
+# (best.pt / obj1.pt) and returns detections in the server's reply format, so
+# the client's feedback and drawing code doesn't care where they came from.
+
+SERVER = "server"
+LOCAL = "local"
+
+
+class OffloadScheduler:
+    """Chooses between the server and the local model from measured latencies."""
+
+    def __init__(self, to_local=1.3, to_server=0.9, probe_interval=1.0, backoff=(1.0, 30.0),
+                 smoothing=0.3, min_samples=3):
+        self.to_local = to_local
+        self.to_server = to_server
+        self.probe_interval = probe_interval
+        self.backoff_range = backoff
+        self.smoothing = smoothing
+        self.min_samples = min_samples
+        self.connected = False
+        self.target = None           # SERVER or LOCAL once the first connection attempt ends
+        self.server_rtt = None       # seconds, moving average
+        self.local_latency = None    # seconds, moving average
+        self.server_samples = 0      # replies on this connection
+        self.since_switch = 0        # replies since the last switch
+        self.switches = 0
+        self.on_switch = None        # called with the new target after every switch
+        self._backoff = backoff[0]
+        self._last_probe = 0.0
+
+    # ---- measurements ----
+    def connected_to_server(self):
+        """A connection is up; the server is tried first until its replies say otherwise."""
+        self.connected = True
+        self._backoff = self.backoff_range[0]
+        self.server_rtt = None
+        self.server_samples = 0
+        self._switch(SERVER)
+
+    def disconnected(self):
+        self.connected = False
+        self._switch(LOCAL)
+
+    def record_server(self, rtt):
+        """A reply (or a timeout, as RESPONSE_TIMEOUT) for a frame sent `rtt` seconds ago."""
+        self.server_rtt = self._average(self.server_rtt, rtt)
+        self.server_samples += 1
+        self.since_switch += 1
+        self._evaluate()
+
+    def record_local(self, seconds):
+        self.local_latency = self._average(self.local_latency, seconds)
+        self._evaluate()
+
+    # ---- decisions ----
+    def use_server(self):
+        return self.target == SERVER
+
+    def use_local(self):
+        return self.target == LOCAL
+
+    def should_probe(self):
+        """While running locally but connected: time to send the server one frame?"""
+        if not self.connected or self.target == SERVER:
+            return False
+        now = time.time()
+        if now - self._last_probe < self.probe_interval:
+            return False
+        self._last_probe = now
+        return True
+
+    def next_backoff(self):
+        """Seconds to wait before the next reconnect attempt."""
+        delay = self._backoff
+        self._backoff = min(self.backoff_range[1], self._backoff * 2)
+        return delay * random.uniform(0.8, 1.2)
+
+    def stats(self):
+        return {"target": self.target, "connected": self.connected, "switches": self.switches,
+                "server_rtt_ms": None if self.server_rtt is None else round(self.server_rtt * 1000, 1),
+                "local_ms": (None if self.local_latency is None
+                             else round(self.local_latency * 1000, 1))}
+
+    def _average(self, current, sample):
+        return sample if current is None else current + self.smoothing * (sample - current)
+
+    def _evaluate(self):
+        if not self.connected:
+            self._switch(LOCAL)
+        elif self.local_latency is None or self.since_switch < self.min_samples:
+            # Every decision rests on min_samples replies measured under the current target
+            return
+        elif self.target == SERVER and self.server_rtt > self.local_latency * self.to_local:
+            self._switch(LOCAL)
+        elif self.target == LOCAL and self.server_rtt < self.local_latency * self.to_server:
+            self._switch(SERVER)
+
+    def _switch(self, target):
+        if target == self.target:
+            return
+        self.target = target
+        self.since_switch = 0
+        self.switches += 1
+        print(f"Offload: using {target} inference ({self.stats()})")
+        if self.on_switch:
+            self.on_switch(target)
+
+
+class LocalDetector:
+    """The standalone scripts' models, answering frames on the device.
+
+    `models` maps mode -> weights path; `combined` maps a combined mode (e.g.
+    "both") to the modes whose models it runs. Models are loaded by load(),
+    which is slow and meant to run on a thread at startup. Each mode keeps its
+    own IoUTracker so detections carry stable track ids like the server's.
+    """
+
+    def __init__(self, models, combined=None, backend="torch", quantized_modes=(),
+                 threshold=0.5):
+        self.paths = models
+        self.combined = combined or {}
+        self.backend = backend
+        self.quantized_modes = set(quantized_modes)
+        self.threshold = threshold
+        self.models = {}
+        self.trackers = {}
+        self.ready = False
+        self.error = None
+        self._lock = threading.Lock()  # detect() runs on worker threads
+
+    def load(self, warmup_size=(640, 480)):
+        """Load every model and run it once; returns the warm inference time in seconds."""
+        try:
+            # Imported here: the client only needs ultralytics once it falls back
+            from inference_backends import load_model
+            for name, path in self.paths.items():
+                print(f"Loading local {name} model from {path}...")
+                self.models[name] = load_model(path, self.backend, name in self.quantized_modes)
+            blank = np.zeros((warmup_size[1], warmup_size[0], 3), np.uint8)
+            for model in self.models.values():
+                model(blank, verbose=False)  # first call pays for lazy initialization
+            start = time.perf_counter()
+            for model in self.models.values():
+                model(blank, verbose=False)
+            seconds = (time.perf_counter() - start) / max(1, len(self.models))
+        except Exception as e:
+            self.error = e
+            print(f"Local models unavailable: {e}")
+            return None
+        self.ready = True
+        print(f"Local models ready ({seconds * 1000:.0f} ms per frame)")
+        return seconds
+
+    def supports(self, mode):
+        return self.ready and all(m in self.models for m in self.combined.get(mode, [mode]))
+
+    def detect(self, frame, mode):
+        """Detections for `frame` as the server's reply dicts (with "source" and "track_id")."""
+        detections = []
+        with self._lock:
+            for source in self.combined.get(mode, [mode]):
+                model = self.models[source]
+                boxes = model(frame, verbose=False)[0].boxes.data
+                boxes = boxes.cpu().numpy() if hasattr(boxes, "cpu") else np.asarray(boxes)
+                tracker = self.trackers.setdefault(source, IoUTracker())
+                tracks = tracker.update(boxes[boxes[:, 4] >= self.threshold, :6])
+                for x1, y1, x2, y2, score, class_id, track_id in tracks.tolist():
+                    detections.append({"label": model.names[int(class_id)],
+                                       "score": round(score, 4),
+                                       "box": [round(v, 1) for v in (x1, y1, x2, y2)],
+                                       # Own namespace: never collides with the server's ids
+                                       "track_id": f"local-{source}-{int(track_id)}",
+                                       "source": source})
+        return detections
+
+    def reset_tracks(self):
+        with self._lock:
+            for tracker in self.trackers.values():
+                tracker.reset()
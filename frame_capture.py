@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+import numpy as np
+
+# Camera capture on its own thread.
+#
+# The capture thread calls camera.capture_array() back to back and copies each
+# frame into the next slot of a small preallocated ring. Consumers ask for the
+# newest frame and get a view of its slot, not a copy; the slot stays theirs
+# until they release() it, and the capture thread skips held slots. Capture
+# therefore overlaps with encoding, inference and networking instead of adding
+# to every frame's latency, and stale frames are simply overwritten.
+
+class CameraCapture:
+    """Latest-frame access to a camera (anything with capture_array()).
+
+    `slots` must exceed the number of frames a consumer holds at once (e.g.
+    frames waiting for a server reply) by at least two: one being written, one
+    ready to hand out. When every slot is held, new frames are dropped.
+    """
+
+    def __init__(self, camera, slots=4):
+        self.camera = camera
+        self.slot_count = slots
+        self.ring = None               # (slots, h, w, c) array, allocated on the first frame
+        self.seqs = [-1] * slots       # frame number in each slot
+        self.times = [0.0] * slots     # capture time of each slot
+        self.held = [0] * slots        # consumers holding each slot
+        self.latest_slot = None
+        self.error = None              # exception that stopped the capture thread
+        self.captured = 0
+        self.dropped = 0
+        self._write_slot = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._loop = None
+        self._new_frame = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2.0)
+
+    def latest(self, after=-1, timeout=None):
+        """Wait for a frame newer than frame number `after`; returns (seq, frame, captured_at).
+
+        The frame is a view into the ring and stays valid until release(seq).
+        Raises the capture thread's exception (e.g. ReplayFinished) once it stops.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._ready(after), timeout):
+                raise TimeoutError("no new frame from the camera")
+            return self._take()
+
+    async def next_frame(self, after=-1):
+        """latest() for asyncio code: waits without blocking the event loop."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._new_frame = asyncio.Event()
+        while True:
+            self._new_frame.clear()
+            with self._cond:
+                if self._ready(after):
+                    return self._take()
+            await self._new_frame.wait()
+
+    def release(self, seq):
+        """Give a frame's slot back to the capture thread."""
+        with self._cond:
+            for slot in range(self.slot_count):
+                if self.seqs[slot] == seq and self.held[slot]:
+                    self.held[slot] -= 1
+                    return
+
+    def stats(self):
+        return {"captured": self.captured, "dropped": self.dropped,
+                "held": sum(1 for h in self.held if h)}
+
+    def _ready(self, after):
+        if self.error is not None:
+            return True
+        return self.latest_slot is not None and self.seqs[self.latest_slot] > after
+
+    def _take(self):
+        if self.error is not None:
+            raise self.error
+        slot = self.latest_slot
+        self.held[slot] += 1
+        return self.seqs[slot], self.ring[slot], self.times[slot]
+
+    def _next_free_slot(self):
+        for step in range(self.slot_count):
+            slot = (self._write_slot + step) % self.slot_count
+            if not self.held[slot] and slot != self.latest_slot:
+                return slot
+        return None
+
+    def _capture_loop(self):
+        while self._running:
+            try:
+                frame = self.camera.capture_array()
+            except Exception as e:
+                with self._cond:
+                    self.error = e
+                    self._cond.notify_all()
+                self._notify_loop()
+                return
+            captured_at = time.time()
+            with self._cond:
+                if self.ring is None or self.ring.shape[1:] != frame.shape:
+                    # Held views keep the old buffer alive, so reallocating is safe
+                    self.ring = np.empty((self.slot_count,) + frame.shape, dtype=frame.dtype)
+                    self.held = [0] * self.slot_count
+                    self.seqs = [-1] * self.slot_count
+                    self.latest_slot = None
+                slot = self._next_free_slot()
+                if slot is None:
+                    self.dropped += 1
+                    continue
+            # Only the capture thread writes, and never a held or handed-out slot
+            np.copyto(self.ring[slot], frame)
+            with self._cond:
+                self.seqs[slot] = self.captured
+                self.times[slot] = captured_at
+                self.latest_slot = slot
+                self._write_slot = (slot + 1) % self.slot_count
+                self.captured += 1
+                self._cond.notify_all()
+            self._notify_loop()
+
+    def _notify_loop(self):
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._new_frame.set)
+            except RuntimeError:
+                pass  # event loop already closed
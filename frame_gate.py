@@ -0,0 +1,57 @@
+import time
+
+from image_hash import dhash, hamming, sharpness, to_small_gray
+
+
+class FrameGate:
+    """Decide on the wearable whether a captured frame is worth encoding and sending.
+
+    Works on a small grayscale copy of the frame, so it costs far less than the
+    JPEG encode it saves. A frame is skipped when it is motion-blurred
+    (Laplacian variance below `min_sharpness`) or when it looks the same as the
+    last frame we sent (dHash distance below `min_change_bits`). After
+    `max_skip_seconds` without sending, the next frame goes through anyway so
+    results stay fresh.
+    """
+
+    def __init__(self, min_sharpness=60.0, min_change_bits=6, max_skip_seconds=2.0,
+                 size=(160, 120)):
+        self.min_sharpness = min_sharpness
+        self.min_change_bits = min_change_bits
+        self.max_skip_seconds = max_skip_seconds
+        self.size = size
+
+        self.last_hash = None
+        self.last_sent_time = 0.0
+        self.sent = 0
+        self.skipped_static = 0
+        self.skipped_blurry = 0
+
+    def check(self, frame):
+        """Return (send, reason) for a captured frame."""
+        gray = to_small_gray(frame, self.size)
+        overdue = time.time() - self.last_sent_time >= self.max_skip_seconds
+
+        if not overdue and sharpness(gray) < self.min_sharpness:
+            self.skipped_blurry += 1
+            return False, "blurry"
+
+        frame_hash = dhash(gray)
+        if (not overdue and self.last_hash is not None
+                and hamming(frame_hash, self.last_hash) < self.min_change_bits):
+            self.skipped_static += 1
+            return False, "static"
+
+        self.last_hash = frame_hash
+        self.last_sent_time = time.time()
+        self.sent += 1
+        return True, "changed"
+
+    def reset(self):
+        """Let the next frame through (e.g. after a mode switch)."""
+        self.last_hash = None
+        self.last_sent_time = 0.0
+
+    def stats(self):
+        return {"sent": self.sent, "skipped_static": self.skipped_static,
+                "skipped_blurry": self.skipped_blurry}
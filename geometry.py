@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+# Frame resizing and box mapping shared by the wearable client and the inference workers.
+
+def fit_to_input(frame, input_size):
+    """Shrink a frame so its longer side is at most `input_size`, keeping the aspect ratio.
+
+    This is the resize half of YOLO's letterbox. The padding half is left to the
+    model on the server, which pads every input anyway; padding on the client
+    would only add bytes to encode and send. Frames that already fit are returned
+    unchanged.
+    """
+    h, w = frame.shape[:2]
+    r = input_size / max(h, w)
+    if r >= 1.0:
+        return frame
+    size = (max(1, round(w * r)), max(1, round(h * r)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+def scale_boxes(detections, from_size, to_size):
+    """Map the boxes of an (N, 6) detection array between image sizes given as (w, h).
+
+    Returns a new array; the input (which may be shared through the result cache)
+    is left untouched.
+    """
+    if tuple(from_size) == tuple(to_size):
+        return detections
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    mapped = detections.copy()
+    mapped[:, [0, 2]] = np.clip(mapped[:, [0, 2]] * sx, 0, to_size[0])
+    mapped[:, [1, 3]] = np.clip(mapped[:, [1, 3]] * sy, 0, to_size[1])
+    return mapped
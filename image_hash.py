@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+
+# Perceptual hashing helpers shared by the wearable's frame gate and the server's result cache.
+
+def to_small_gray(frame, size=(160, 120)):
+    """Downsample a BGR (or already gray) frame to a small grayscale image."""
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+def dhash(gray, hash_size=8):
+    """Difference hash of a grayscale image as a hash_size*hash_size bit integer.
+
+    Each bit says whether a pixel is brighter than its right neighbour, so the hash
+    survives noise, small exposure changes and JPEG artefacts but flips on real
+    scene changes.
+    """
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+def sharpness(gray):
+    """Variance of the Laplacian; low values mean a blurred (or featureless) image."""
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
@@ -0,0 +1,200 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+# Selects how a model's weights are executed. "torch" runs the .pt checkpoint as
+# before; "onnx" (ONNX Runtime) and "openvino" export the checkpoint once and run
+# the exported graph, which is usually much faster on CPU-only boxes. Exported
+# models are still driven through ultralytics, so results have exactly the same
+# format (Results objects, same class names and box coordinates).
+# "stub" needs no weights at all: a fake model with a configurable delay, for
+# benchmarking the server and protocol offline (see benchmark_ws.py).
+#
+# INT8 variants are built offline by quantize_models.py from recorded frames and
+# stored next to the exports. They are only loaded when the tool accepted them
+# (accuracy drift within its limits); otherwise the float model is used.
+#
+# ultralytics is imported where a real model is built, so the stub backend runs
+# on machines without ultralytics/torch.
+
+BACKENDS = ["torch", "onnx", "openvino", "stub"]
+EXPORT_DIR = os.environ.get("MODEL_EXPORT_DIR", "./exported_models")
+DEFAULT_INPUT_SIZE = 640
+# Simulated cost of a stub model call: fixed part per batch plus a part per frame
+STUB_BATCH_MS = float(os.environ.get("STUB_BATCH_MS", 20))
+STUB_FRAME_MS = float(os.environ.get("STUB_FRAME_MS", 5))
+
+class _StubBoxes:
+    def __init__(self, data):
+        self.data = data
+
+
+class _StubResult:
+    def __init__(self, data, names):
+        self.boxes = _StubBoxes(data)
+        self.names = names
+
+
+class StubModel:
+    """Stands in for a YOLO model: same call signature and result layout, no weights.
+
+    Each call sleeps STUB_BATCH_MS + STUB_FRAME_MS per frame (sleeping releases
+    the GIL like real inference does) and returns one centred box per frame whose
+    class follows the frame's brightness, so different frames give different labels.
+    """
+
+    def __init__(self, weights_path, num_classes=5, input_size=DEFAULT_INPUT_SIZE):
+        stem = os.path.splitext(os.path.basename(weights_path))[0]
+        self.names = {i: f"{stem}_{i}" for i in range(num_classes)}
+        self.overrides = {"imgsz": input_size}
+
+    def __call__(self, frames, verbose=False, **kwargs):
+        if not isinstance(frames, list):
+            frames = [frames]
+        time.sleep((STUB_BATCH_MS + STUB_FRAME_MS * len(frames)) / 1000)
+        results = []
+        for frame in frames:
+            h, w = frame.shape[:2]
+            class_id = int(frame[::16, ::16].mean()) % len(self.names)
+            box = [w * 0.25, h * 0.25, w * 0.75, h * 0.75, 0.9, class_id]
+            results.append(_StubResult(np.array([box], dtype=np.float32), self.names))
+        return results
+
+
+def weights_hash(path):
+    """Short content hash of a weights file, so re-trained weights get a fresh export."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def artifact_path(weights_path, backend, export_dir=EXPORT_DIR):
+    """Where the export of `weights_path` for `backend` is cached."""
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    name = f"{stem}-{weights_hash(weights_path)}"
+    suffix = ".onnx" if backend == "onnx" else "_openvino_model"
+    return os.path.join(export_dir, name + suffix)
+
+def quantized_path(weights_path, export_dir=EXPORT_DIR):
+    """Where the INT8 ONNX model built from `weights_path` is stored."""
+    return artifact_path(weights_path, "onnx", export_dir).replace(".onnx", "-int8.onnx")
+
+def info_path(artifact):
+    """Sidecar JSON describing an exported artifact (input size, quantization report)."""
+    if artifact.endswith("_openvino_model"):
+        return os.path.join(artifact, "model_info.json")
+    return os.path.splitext(artifact)[0] + ".json"
+
+def read_model_info(artifact):
+    try:
+        with open(info_path(artifact)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_model_info(artifact, info):
+    with open(info_path(artifact), "w") as f:
+        json.dump(info, f, indent=2)
+
+def weights_info_path(weights_path, export_dir=EXPORT_DIR):
+    """Sidecar describing a checkpoint; the same file as its ONNX export's sidecar."""
+    return info_path(artifact_path(weights_path, "onnx", export_dir))
+
+def read_weights_info(weights_path, export_dir=EXPORT_DIR):
+    """Class names and input size remembered for a checkpoint, or None if never loaded.
+
+    Lets the server describe its modes without loading every model at startup.
+    """
+    try:
+        with open(weights_info_path(weights_path, export_dir)) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None  # no sidecar yet (or no weights file at all)
+    if "classes" not in info or "imgsz" not in info:
+        return None
+    imgsz = info["imgsz"]
+    return {"classes": info["classes"],
+            "input_size": max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)}
+
+def remember_weights_info(weights_path, classes, input_size, export_dir=EXPORT_DIR):
+    """Store a loaded checkpoint's class names and input size next to its exports."""
+    path = weights_info_path(weights_path, export_dir)
+    info = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            info = json.load(f)
+    if info.get("classes") == classes and info.get("imgsz") == input_size:
+        return
+    info.update(classes=classes, imgsz=input_size, weights=os.path.abspath(weights_path))
+    os.makedirs(export_dir, exist_ok=True)
+    with open(path + ".part", "w") as f:
+        json.dump(info, f, indent=2)
+    os.replace(path + ".part", path)  # workers may read it concurrently
+
+def export_model(weights_path, backend, export_dir=EXPORT_DIR):
+    """Export a .pt checkpoint for `backend` unless a cached export already exists.
+
+    Workers starting together share one export: the first takes a file lock and
+    exports, the rest wait on the lock and then find the cached artifact.
+    """
+    dest = artifact_path(weights_path, backend, export_dir)
+    if os.path.exists(dest):
+        return dest
+
+    os.makedirs(export_dir, exist_ok=True)
+    with open(dest + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(dest):
+            return dest
+
+        print(f"Exporting {weights_path} for {backend} (one-time)...")
+        from ultralytics import YOLO
+        model = YOLO(weights_path)
+        imgsz = model.overrides.get("imgsz", 640)
+        exported = model.export(format=backend, imgsz=imgsz, dynamic=True)
+        shutil.move(exported, dest)
+        # Keep the input size next to the artifact; exported models don't carry
+        # ultralytics overrides, and clients need it to size their frames
+        write_model_info(dest, dict(read_model_info(dest), imgsz=imgsz,
+                                    weights=os.path.abspath(weights_path)))
+        print(f"Exported {weights_path} -> {dest}")
+    return dest
+
+def _load_artifact(artifact):
+    from ultralytics import YOLO
+    model = YOLO(artifact, task="detect")
+    imgsz = read_model_info(artifact).get("imgsz")
+    if imgsz:
+        model.overrides["imgsz"] = imgsz
+    return model
+
+def load_model(weights_path, backend="torch", quantized=False):
+    """Load a model for `backend`, exporting the checkpoint first if needed.
+
+    With `quantized=True` the accepted INT8 variant (see quantize_models.py) is
+    loaded instead; if there is none, `backend` is used as a fallback.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "stub":
+        return StubModel(weights_path)
+    if quantized:
+        artifact = quantized_path(weights_path)
+        if os.path.exists(artifact) and read_model_info(artifact).get("accepted"):
+            return _load_artifact(artifact)
+        print(f"No accepted INT8 model for {weights_path} (run quantize_models.py), "
+              f"using {backend}")
+    if backend == "torch":
+        from ultralytics import YOLO
+        return YOLO(weights_path)
+    return _load_artifact(export_model(weights_path, backend))
+
+def get_input_size(model):
+    """Longest side the model resizes its inputs to (its training imgsz)."""
+    imgsz = getattr(model, "overrides", {}).get("imgsz") or DEFAULT_INPUT_SIZE
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
@@ -0,0 +1,361 @@
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from geometry import scale_boxes
+from image_hash import dhash, to_small_gray
+from model_registry import ModelRegistry, load_config
+from result_cache import ResultCache
+
+# Everything in this module runs inside the inference executor (thread or process pool),
+# never on the server's event loop. Each worker holds its own model instances.
+
+# -------------------- Configuration --------------------
+# Modes, their weights and the combined modes come from the models config
+# (see model_registry.py); adding a mode is a config change.
+MODELS_CONFIG = os.environ.get("MODELS_CONFIG", "./models.json")
+_config = load_config(MODELS_CONFIG)
+MODEL_PATHS = {mode: spec["path"] for mode, spec in _config["modes"].items()}
+# Modes that run several models on the same decoded frame, in parallel. Their
+# class ids index the concatenation of the source models' class tables.
+COMBINED_MODES = _config["combined"]
+# "torch" runs the .pt checkpoints; "onnx" / "openvino" export them once (cached
+# under MODEL_EXPORT_DIR by weights hash) and run the exported graphs on CPU.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+# Modes that run their INT8 model (built and accepted by quantize_models.py),
+# e.g. QUANTIZED_MODES=currency,object. Modes without an accepted one stay float.
+QUANTIZED_MODES = [m for m in os.environ.get("QUANTIZED_MODES", "").split(",") if m]
+# "startup": every worker loads its models (in parallel) when it starts.
+# "lazy": a model is loaded by the first frame that needs it. Class tables and
+# input sizes then come from the sidecar written when the model was last loaded,
+# so startup loads nothing (only the very first run has to load each model once).
+MODEL_LOAD = os.environ.get("MODEL_LOAD", "startup")
+# Models each worker keeps in memory; the least recently used is evicted past
+# this (0 = keep all). A combined mode holds all its sources during a batch.
+MAX_RESIDENT_MODELS = int(os.environ.get("MAX_RESIDENT_MODELS", 0))
+# Dummy inferences after every model load; the first real frames then run at
+# steady-state speed. The median of the later runs is reported as warm latency.
+WARMUP_RUNS = int(os.environ.get("WARMUP_RUNS", 3))
+# How long a worker waits for the others when the server checks they are all up
+WORKER_STARTUP_TIMEOUT = float(os.environ.get("WORKER_STARTUP_TIMEOUT", 600))
+DETECTION_THRESHOLD = 0.5
+# Frames much larger than the model input are decoded at 1/2, 1/4 or 1/8 scale
+# (libjpeg DCT scaling): never below the input size, so the model sees the same
+# pixels it would after its own downscale, for a fraction of the decode cost.
+DECODE_REDUCED = os.environ.get("DECODE_REDUCED", "1") == "1"
+# Near-duplicate frames reuse cached detections instead of running the model.
+# The cache is shared by the threads of one process (one cache per worker process).
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 256))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 4 * 1024 * 1024))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", 2.0))
+CACHE_HASH_SIZE = int(os.environ.get("CACHE_HASH_SIZE", 16))       # 16 -> 256-bit dHash
+CACHE_MAX_DISTANCE = int(os.environ.get("CACHE_MAX_DISTANCE", 8))  # bits that may differ
+
+_worker = threading.local()
+_cache = ResultCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL_SECONDS, CACHE_MAX_DISTANCE)
+
+# -------------------- Worker Setup --------------------
+def init_worker(torch_threads=0):
+    """Create this worker's model registry (executor initializer).
+
+    Each worker has its own registry and model instances; with MODEL_LOAD=startup
+    its models are loaded here, in parallel.
+    """
+    if torch_threads:
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except Exception as e:
+            print(f"Could not limit torch threads: {e}")
+
+    _worker.registry = ModelRegistry(_config["modes"], INFERENCE_BACKEND,
+                                     MAX_RESIDENT_MODELS, QUANTIZED_MODES, WARMUP_RUNS)
+    if MODEL_LOAD == "startup":
+        print(f"[worker {os.getpid()}/{threading.get_ident()}] Loading YOLO models ({INFERENCE_BACKEND})...")
+        _worker.registry.preload()
+        print(f"[worker {os.getpid()}/{threading.get_ident()}] Models loaded: {list(_worker.registry.models)}")
+
+def get_registry():
+    """This worker's model registry, created on first use."""
+    if not hasattr(_worker, "registry"):
+        init_worker()
+    return _worker.registry
+
+def get_model(mode):
+    """Return this worker's model for `mode`; raises ModelUnavailable if it can't be loaded."""
+    return get_registry().get(mode)
+
+# -------------------- Decode / Inference / Postprocess --------------------
+REDUCED_DECODE_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2)]
+# Start-of-frame markers carry the image size (C4, C8 and CC are other segments)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(data):
+    """(w, h) of a JPEG read from its frame header, or None if it isn't a JPEG."""
+    data = bytes(data[:65536]) if not isinstance(data, bytes) else data
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            h, w = struct.unpack(">HH", data[i + 5:i + 9])
+            return w, h
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+def decode_frame(data, input_size=0):
+    """Decode JPEG bytes into a BGR frame, or None if the payload is not an image.
+
+    With an `input_size`, large JPEGs are decoded at the smallest DCT scale whose
+    longer side still covers the model input (see DECODE_REDUCED).
+    """
+    nparr = np.frombuffer(data, np.uint8)
+    if input_size and DECODE_REDUCED:
+        size = jpeg_size(data)
+        if size:
+            return cv2.imdecode(nparr, reduced_decode(size, input_size)[1])
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def reduced_decode(size, input_size):
+    """(factor, imdecode flag) that decode_frame uses for a JPEG of `size` (w, h)."""
+    if input_size and DECODE_REDUCED:
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if max(size) // factor >= input_size:
+                return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+def decode_for_model(data, source_size, input_size=0):
+    """decode_frame() plus the size boxes are reported in: the client's captured
+    size if it shrank the frame, else the JPEG's own size (which a reduced decode
+    does not have). Returns (frame or None, (w, h) or None)."""
+    frame = decode_frame(data, input_size)
+    if frame is None or source_size:
+        return frame, source_size
+    if input_size and DECODE_REDUCED:
+        return frame, jpeg_size(data) or (frame.shape[1], frame.shape[0])
+    return frame, None
+
+def filter_detections(results, threshold=DETECTION_THRESHOLD):
+    """Return the rows of a YOLO result scoring at least `threshold`.
+
+    Rows are float32 [x1, y1, x2, y2, score, class_id]; filtering is a single
+    mask over the boxes tensor rather than a Python loop per box.
+    """
+    data = results.boxes.data
+    if hasattr(data, "cpu"):
+        data = data.cpu().numpy()
+    data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+    return data[data[:, 4] >= threshold]
+
+def get_helper_pool():
+    """This worker's threads for running the extra models of a combined mode."""
+    if not hasattr(_worker, "helpers"):
+        extra = max([len(sources) - 1 for sources in COMBINED_MODES.values()] + [1])
+        _worker.helpers = ThreadPoolExecutor(max_workers=extra)
+    return _worker.helpers
+
+def source_modes(mode):
+    """The single-model modes that `mode` runs."""
+    return COMBINED_MODES.get(mode, [mode])
+
+def class_offsets(mode):
+    """Where each source model's class ids start in a combined mode's class table."""
+    offsets, start = [], 0
+    for source in source_modes(mode):
+        offsets.append(start)
+        start += len(get_registry().describe(source)["classes"])
+    return offsets
+
+def get_model_info():
+    """Return {"classes": {mode: [name by id]}, "sources": {mode: [source by id]},
+    "input_sizes": {mode: int}, "unavailable": {mode: reason}} for every mode that
+    can be served, including combined modes whose sources are all available.
+    Models without a stored description (sidecar) are loaded, in parallel, to read
+    their class tables.
+    """
+    registry = get_registry()
+    described = registry.describe_all()
+    classes = {mode: info["classes"] for mode, info in described.items()}
+    input_sizes = {mode: info["input_size"] for mode, info in described.items()}
+    sources = {}
+    unavailable = dict(registry.errors)
+    for mode, parts in COMBINED_MODES.items():
+        if all(part in described for part in parts):
+            classes[mode] = [name for part in parts for name in classes[part]]
+            sources[mode] = [part for part in parts for _ in classes[part]]
+            input_sizes[mode] = max(input_sizes[part] for part in parts)
+        else:
+            unavailable[mode] = "needs " + ", ".join(p for p in parts if p not in described)
+    return {"classes": classes, "sources": sources, "input_sizes": input_sizes,
+            "unavailable": unavailable}
+
+def worker_status(barrier=None):
+    """Load/warmup status of this worker's models (after its initializer has run).
+
+    The server calls this once per worker with a shared barrier, so each call
+    is held by a different worker and every worker has to finish starting up.
+    """
+    registry = get_registry()
+    if barrier is not None:
+        try:
+            barrier.wait(WORKER_STARTUP_TIMEOUT)
+        except threading.BrokenBarrierError:
+            pass
+    return {"worker": f"{os.getpid()}/{threading.get_ident()}", "models": registry.model_status()}
+
+def registry_stats():
+    """Resident models and load/eviction counters of this worker's registry."""
+    return get_registry().stats()
+
+def frame_hash(frame):
+    """Perceptual hash used as the result cache key."""
+    return dhash(to_small_gray(frame, (64, 48)), CACHE_HASH_SIZE)
+
+def detect(model, mode, frames, hashes):
+    """Run one model over decoded frames, reusing cached results.
+
+    Returns {"detections": [...], "hits": int, "misses": int, "cache": s,
+    "inference": s, "postprocess": s} with one (N, 6) array per frame and the
+    time spent in each step. The model is passed in so helper threads don't
+    load their own copies.
+    """
+    outputs = [None] * len(frames)
+    misses = []
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        if CACHE_ENABLED:
+            cached = _cache.get(mode, frame.shape, hashes[i])
+            if cached is not None:
+                outputs[i] = cached
+                continue
+        misses.append(i)
+    cache_s = time.perf_counter() - start
+
+    inference_s = postprocess_s = 0.0
+    if misses:
+        start = time.perf_counter()
+        results = model([frames[i] for i in misses], verbose=False)
+        inference_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, result in zip(misses, results):
+            outputs[i] = filter_detections(result)
+        postprocess_s = time.perf_counter() - start
+
+        if CACHE_ENABLED:
+            start = time.perf_counter()
+            for i in misses:
+                _cache.put(mode, frames[i].shape, hashes[i], outputs[i])
+            cache_s += time.perf_counter() - start
+
+    return {"detections": outputs,
+            "hits": len(frames) - len(misses) if CACHE_ENABLED else 0,
+            "misses": len(misses) if CACHE_ENABLED else 0,
+            "cache": cache_s, "inference": inference_s, "postprocess": postprocess_s}
+
+def process_batch(mode, payloads, input_size=0):
+    """Decode, infer and postprocess a batch of frames for one mode.
+
+    `payloads` are (jpeg_bytes, source_size) pairs; when source_size (w, h) is
+    given the client shrank the frame before encoding, and boxes are mapped back
+    to the captured frame. `input_size` is the mode's model input size, used to
+    decode oversized JPEGs at reduced scale (boxes still come back in full size).
+    Returns {"detections": [...], "cache_hits": int, "cache_misses": int,
+    "timings": {...}} with one detections entry per payload:
+    an (N, 6) array (see filter_detections), or None when the payload could not
+    be decoded. "timings" has the batch's wall-clock start ("started") and the
+    seconds spent decoding (per frame), in the cache, in inference (per source
+    model) and in postprocessing.
+    """
+    started = time.time()
+    frames, sizes, decode_times = [], [], []
+    for data, source_size in payloads:
+        start = time.perf_counter()
+        frame, size = decode_for_model(data, source_size, input_size)
+        frames.append(frame)
+        sizes.append(size)
+        decode_times.append(time.perf_counter() - start)
+    batch = process_frames(mode, frames, sizes)
+    batch["timings"].update(started=started, decode=decode_times)
+    return batch
+
+def process_frames(mode, frames, source_sizes):
+    """Infer and postprocess already decoded frames (None for frames that failed to decode).
+
+    Same result as process_batch, without decode timings. The frames are only
+    read, never kept, so they may be views into shared memory.
+
+    Combined modes hash each frame once and run their source models
+    concurrently; their class ids are offset into the combined class table.
+    """
+    timings = {"started": time.time(), "decode": [], "cache": 0.0, "inference": {},
+               "postprocess": 0.0}
+    outputs = [None] * len(frames)
+    sizes = [None] * len(frames)  # (decoded (w, h), reply (w, h))
+    indices = [i for i, frame in enumerate(frames) if frame is not None]
+    frames = [frames[i] for i in indices]
+    for i, frame in zip(indices, frames):
+        decoded_size = (frame.shape[1], frame.shape[0])
+        sizes[i] = (decoded_size, source_sizes[i] or decoded_size)
+
+    hits = misses = 0
+    if frames:
+        start = time.perf_counter()
+        hashes = [frame_hash(f) if CACHE_ENABLED else None for f in frames]
+        timings["cache"] += time.perf_counter() - start
+
+        sources = source_modes(mode)
+        models = [get_model(source) for source in sources]
+        # The first model runs on this thread, any others on helper threads
+        futures = [get_helper_pool().submit(detect, model, source, frames, hashes)
+                   for model, source in zip(models[1:], sources[1:])]
+        per_source = [detect(models[0], sources[0], frames, hashes)]
+        per_source += [future.result() for future in futures]
+
+        start = time.perf_counter()
+        offsets = class_offsets(mode)
+        for n, i in enumerate(indices):
+            if len(sources) == 1:
+                outputs[i] = per_source[0]["detections"][n]
+                continue
+            parts = []
+            for result, offset in zip(per_source, offsets):
+                part = result["detections"][n].copy()  # cached arrays are shared
+                part[:, 5] += offset
+                parts.append(part)
+            outputs[i] = np.concatenate(parts)
+        timings["postprocess"] += time.perf_counter() - start
+
+        for source, result in zip(sources, per_source):
+            hits += result["hits"]
+            misses += result["misses"]
+            timings["cache"] += result["cache"]
+            timings["postprocess"] += result["postprocess"]
+            if result["misses"] or not CACHE_ENABLED:
+                timings["inference"][source] = result["inference"]
+
+    # Cached arrays are shared, so scale_boxes always returns a copy when it maps
+    start = time.perf_counter()
+    for i, size in enumerate(sizes):
+        if size is not None:
+            outputs[i] = scale_boxes(outputs[i], *size)
+    timings["postprocess"] += time.perf_counter() - start
+
+    return {"detections": outputs, "cache_hits": hits, "cache_misses": misses,
+            "timings": timings}
+
+def cache_stats():
+    """Counters of this worker process's result cache."""
+    return _cache.stats()
@@ -0,0 +1,465 @@
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+from frame_capture import CameraCapture
+from inference_backends import load_model
+from session_recording import ReplayFinished, ReplaySource
+from tracker import FlowPropagator, IoUTracker
+
+# On-device detection without the server: the standalone scripts (main1.py,
+# button_python.py, currency.py, ...) are configurations of LocalRuntime.
+#
+# The work runs as four stages so they overlap instead of running back to back:
+#   capture    camera thread writing into a ring (frame_capture.CameraCapture);
+#              the inference stage always takes the newest frame
+#   inference  detector every `detect_every` frames, optical-flow tracking in
+#              between; sends results to the render queue and new tracks to the
+#              feedback queue
+#   render     boxes, on-screen window and/or video file, on the calling thread
+#              (OpenCV windows must live on one thread)
+#   feedback   turns new tracks into clips/speech (audio_feedback) and GPIO hooks
+# Queues between stages are small and bounded, so a slow stage holds back the
+# ones before it and the camera simply keeps only its newest frame.
+#
+# The frame source is pluggable, so the same pipeline can be benchmarked on any
+# Linux box:
+#   python local_runtime.py --source walk.mp4 --no-display --duration 30
+#   python local_runtime.py --source ./captured_frames --mode object
+#   python local_runtime.py --source sessions/walk1       (recorded session)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_MODELS = {"currency": "./best.pt", "object": "./obj1.pt"}
+BOX_COLOR = (0, 255, 0)
+# Stage times and latencies kept for the percentiles in report(): the most recent frames only
+STATS_WINDOW = 1000
+
+# -------------------- Frame Sources --------------------
+class SourceFinished(Exception):
+    """Raised by a file source's capture_array() after its last frame."""
+
+
+class _PacedSource:
+    """Optional real-time pacing for file sources (interval 0 = as fast as possible)."""
+
+    interval = 0.0
+    _due = None
+
+    def _pace(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self._due is not None and self._due > now:
+            time.sleep(self._due - now)
+        self._due = max(now, self._due or now) + self.interval
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class VideoFileSource(_PacedSource):
+    """Frames of a video file through the Picamera2 capture API."""
+
+    def __init__(self, path, realtime=False, loop=False):
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f"Cannot open video {path}")
+        self.interval = 1.0 / (self.video.get(cv2.CAP_PROP_FPS) or 30.0) if realtime else 0.0
+        self.loop = loop
+
+    def capture_array(self):
+        ok, frame = self.video.read()
+        if not ok and self.loop:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.video.read()
+        if not ok:
+            raise SourceFinished()
+        self._pace()
+        return frame
+
+    def close(self):
+        self.video.release()
+
+
+class ImageDirectorySource(_PacedSource):
+    """The images of a directory (sorted by name) through the Picamera2 capture API."""
+
+    def __init__(self, directory, fps=0, loop=False):
+        self.paths = sorted(p for p in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                            if p.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.paths:
+            raise ValueError(f"No images found in {directory}")
+        self.interval = 1.0 / fps if fps else 0.0
+        self.loop = loop
+        self.position = 0
+
+    def capture_array(self):
+        while True:
+            if self.position >= len(self.paths):
+                if not self.loop:
+                    raise SourceFinished()
+                self.position = 0
+            frame = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if frame is not None:
+                self._pace()
+                return frame
+
+    def close(self):
+        pass
+
+
+def open_camera(size):
+    """Start the Pi camera at `size` (w, h), configured like the original scripts."""
+    from picamera2 import Picamera2
+    camera = Picamera2()
+    camera.preview_configuration.main.size = size
+    camera.preview_configuration.main.format = "RGB888"
+    camera.preview_configuration.align()
+    camera.configure("preview")
+    camera.start()
+    return camera
+
+def open_source(source, size=(1280, 720), realtime=False, loop=False):
+    """Frame source for "camera", a directory of images, a recorded session or a video file.
+
+    File sources play as fast as they are read unless `realtime` is set.
+    """
+    if source == "camera":
+        return open_camera(size)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, 30 if realtime else 0, loop)
+    if os.path.exists(source + ".index"):
+        return ReplaySource(source, 1.0 if realtime else 0, loop)
+    return VideoFileSource(source, realtime, loop)
+
+# -------------------- Runtime --------------------
+class LocalRuntime:
+    """Capture -> inference -> render -> feedback pipeline for on-device detection.
+
+    `models` maps mode -> weights path; all of them are loaded up front so a
+    mode switch is instant. `source` is a spec for open_source() or any object
+    with capture_array(). Feedback: labels in `clip_labels` play their
+    denomination clip, `speech_template` (e.g. "Detected {label}") speaks
+    every new track, and `label_hooks` maps a label to (on_start, on_done)
+    callbacks run around its clip (e.g. an LED).
+    """
+
+    def __init__(self, models=DEFAULT_MODELS, mode=None, source="camera", size=(1280, 720),
+                 backend="torch", quantized_modes=(), threshold=0.5, detect_every=1,
+                 min_track_score=0.35, display=True, window="Detection", video_out=None,
+                 audio=False, clip_labels=None, speech_template=None, label_hooks=None,
+                 mode_phrase="Switched to {mode} detection mode", speech_rate=130,
+                 realtime=False, loop=False, render_queue=2, feedback_queue=8, stats_every=10.0):
+        self.models = {}
+        for name, path in models.items():
+            print(f"Loading {name} model from {path}...")
+            self.models[name] = load_model(path, backend, name in quantized_modes)
+        self.mode = mode or next(iter(models))
+        self.source = (open_source(source, size, realtime, loop) if isinstance(source, str)
+                       else source)
+        self.threshold = threshold
+        self.detect_every = max(1, detect_every)
+        self.min_track_score = min_track_score
+        self.display = display
+        self.window = window
+        self.video_out = video_out
+        self.clip_labels = clip_labels
+        self.speech_template = speech_template
+        self.label_hooks = label_hooks or {}
+        self.mode_phrase = mode_phrase
+        self.stats_every = stats_every
+
+        self.audio = None
+        if audio:
+            # Imported here so benchmarking without pygame/pyttsx3 works
+            import pyttsx3
+            from audio_feedback import AudioPlayer, PhraseCache
+            engine = pyttsx3.init()
+            engine.setProperty('rate', speech_rate)
+            self.audio = AudioPlayer(speech=PhraseCache(engine))
+            phrases = [mode_phrase.format(mode=m) for m in models] + ["Detection stopped"]
+            if speech_template:
+                phrases += [speech_template.format(label=name) for model in self.models.values()
+                            for name in model.names.values()]
+            self.audio.prerender(phrases)
+
+        # The inference stage holds at most render_queue + 1 frames
+        self.capture = CameraCapture(self.source, slots=render_queue + 3)
+        self.render_queue = queue.Queue(render_queue)
+        self.feedback_queue = queue.Queue(feedback_queue)
+        self.running = False
+        self.finished = False
+        self.error = None
+        self.stats = {"detections": 0, "tracked": 0, "rendered": 0, "announced": 0,
+                      "feedback_dropped": 0, "errors": 0,
+                      "inference_s": deque(maxlen=STATS_WINDOW),
+                      "render_s": deque(maxlen=STATS_WINDOW),
+                      "latency_s": deque(maxlen=STATS_WINDOW)}
+        self._threads = []
+        self._writer = None
+
+    # ---- control ----
+    def set_mode(self, mode):
+        """Switch model (safe to call from button callbacks)."""
+        if mode not in self.models or mode == self.mode:
+            return
+        self.mode = mode
+        print(f"Mode changed to: {mode}")
+        self.say(self.mode_phrase.format(mode=mode))
+
+    def toggle_mode(self, *_):
+        """Next mode in `models` order (usable directly as a GPIO callback)."""
+        modes = list(self.models)
+        self.set_mode(modes[(modes.index(self.mode) + 1) % len(modes)])
+
+    def say(self, text):
+        if self.audio:
+            self.audio.say(text)
+
+    def run(self, duration=None):
+        """Run until 'q', Ctrl+C, the end of a file source or `duration` seconds.
+
+        Rendering happens on this thread. Returns the summary from report().
+        """
+        self.running = True
+        self.started = time.time()
+        self.capture.start()
+        for target in (self._inference_loop, self._feedback_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        try:
+            self._render_loop(duration)
+        except KeyboardInterrupt:
+            print("\nDetection stopped by user.")
+            self.say("Detection stopped")
+        finally:
+            self.stop()
+        return self.report()
+
+    def stop(self):
+        self.running = False
+        self.capture.stop()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+        for method in ("stop", "close"):
+            if hasattr(self.source, method):
+                try:
+                    getattr(self.source, method)()
+                except Exception as e:
+                    print(f"Error closing the frame source: {e}")
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        if self.display:
+            cv2.destroyAllWindows()
+        if self.audio:
+            self.audio.close()
+            self.audio = None
+
+    # ---- stages ----
+    def _inference_loop(self):
+        try:
+            self._run_inference()
+        except Exception as e:
+            self.error = e
+            print(f"Inference stage stopped: {e}")
+        finally:
+            # Also on an unexpected error: the render loop stops once its queue is empty
+            self.running = False
+
+    def _run_inference(self):
+        tracker, flow = IoUTracker(), FlowPropagator()
+        announced = set()
+        tracked_mode = None
+        seq = -1
+        while self.running:
+            try:
+                seq, frame, captured_at = self.capture.latest(seq, timeout=0.5)
+            except TimeoutError:
+                continue
+            except (SourceFinished, ReplayFinished):
+                self.finished = True
+                break
+            except Exception as e:
+                self.error = e
+                print(f"Capture error: {e}")
+                break
+
+            mode = self.mode
+            if mode != tracked_mode:
+                tracker.reset()
+                announced.clear()
+                tracked_mode = mode
+            model = self.models[mode]
+
+            start = time.perf_counter()
+            try:
+                if tracker.needs_detection(self.detect_every, self.min_track_score):
+                    boxes = model(frame, verbose=False)[0].boxes.data
+                    boxes = boxes.cpu().numpy() if hasattr(boxes, "cpu") else np.asarray(boxes)
+                    tracks = tracker.update(boxes[boxes[:, 4] >= self.threshold, :6])
+                    if self.detect_every > 1:
+                        flow.observe(frame)
+                    self.stats["detections"] += 1
+                else:
+                    # Between detector frames: move the tracked boxes with optical flow
+                    tracks = tracker.predict(flow.shifts(frame, tracker.boxes()))
+                    self.stats["tracked"] += 1
+            except Exception as e:
+                # Skip the frame and keep going; the next one is detected from scratch
+                self.error = e
+                self.stats["errors"] += 1
+                if self.stats["errors"] % 100 == 1:  # a broken model fails every frame
+                    print(f"Inference error ({self.stats['errors']} so far): {e}")
+                tracker.reset()
+                self.capture.release(seq)
+                continue
+            self.stats["inference_s"].append(time.perf_counter() - start)
+
+            names = model.names
+            for row in tracks:
+                track_id = int(row[6])
+                if track_id not in announced:
+                    announced.add(track_id)
+                    try:
+                        self.feedback_queue.put_nowait(names[int(row[5])])
+                    except queue.Full:
+                        self.stats["feedback_dropped"] += 1
+
+            item = (seq, frame, captured_at, names, tracks)
+            while self.running:
+                try:
+                    self.render_queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            else:
+                self.capture.release(seq)
+
+    def _render_loop(self, duration):
+        last_stats = time.time()
+        while self.running or not self.render_queue.empty():
+            if duration and time.time() - self.started >= duration:
+                break
+            try:
+                seq, frame, captured_at, names, tracks = self.render_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            try:
+                for x1, y1, x2, y2, score, class_id, _ in tracks.tolist():
+                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), BOX_COLOR, 2)
+                    cv2.putText(frame, f"{names[int(class_id)]} {score:.2f}", (int(x1), int(y1) - 10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, BOX_COLOR, 2)
+                if self.video_out:
+                    if self._writer is None:
+                        self._writer = cv2.VideoWriter(self.video_out, cv2.VideoWriter_fourcc(*"mp4v"),
+                                                       30.0, (frame.shape[1], frame.shape[0]))
+                    self._writer.write(frame)
+                if self.display:
+                    cv2.imshow(self.window, frame)
+            finally:
+                self.capture.release(seq)
+            self.stats["render_s"].append(time.perf_counter() - start)
+            self.stats["latency_s"].append(time.time() - captured_at)
+            self.stats["rendered"] += 1
+
+            if self.display and cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+            if self.stats_every and time.time() - last_stats >= self.stats_every:
+                last_stats = time.time()
+                print(self._stats_line())
+
+    def _feedback_loop(self):
+        while self.running:
+            try:
+                label = self.feedback_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.stats["announced"] += 1
+            if not self.audio:
+                print(f"Detected {label}")
+                continue
+            if (self.clip_labels is None or label in self.clip_labels) and self.audio.has_clip(label):
+                on_start, on_done = self.label_hooks.get(label, (None, None))
+                self.audio.play(label, on_start=on_start, on_done=on_done)
+            if self.speech_template:
+                from audio_feedback import PRIORITY_DETECTION
+                self.audio.say(self.speech_template.format(label=label), PRIORITY_DETECTION)
+
+    # ---- stats ----
+    def report(self):
+        """Frames/s of the run so far; stage times and latency over the last STATS_WINDOW frames."""
+        elapsed = max(1e-9, time.time() - self.started)
+        ms = lambda values, p: round(float(np.percentile(values, p)) * 1000, 1) if values else None
+        return {
+            "seconds": round(elapsed, 1),
+            "fps": round(self.stats["rendered"] / elapsed, 2),
+            "captured": self.capture.captured,
+            "rendered": self.stats["rendered"],
+            "detector_frames": self.stats["detections"],
+            "tracked_frames": self.stats["tracked"],
+            "announced": self.stats["announced"],
+            "errors": self.stats["errors"],
+            "inference_ms_p50": ms(self.stats["inference_s"], 50),
+            "render_ms_p50": ms(self.stats["render_s"], 50),
+            "latency_ms_p50": ms(self.stats["latency_s"], 50),
+            "latency_ms_p95": ms(self.stats["latency_s"], 95),
+        }
+
+    def _stats_line(self):
+        r = self.report()
+        return (f"{r['fps']} fps, inference {r['inference_ms_p50']} ms, "
+                f"latency p50 {r['latency_ms_p50']} / p95 {r['latency_ms_p95']} ms, "
+                f"captured {r['captured']}, rendered {r['rendered']}")
+
+# -------------------- Command Line --------------------
+def main():
+    parser = argparse.ArgumentParser(description="Run the detection pipeline on the device (or any Linux box)")
+    parser.add_argument("--source", default="camera",
+                        help="camera, a video file, a directory of images or a recorded session")
+    parser.add_argument("--model", action="append", metavar="MODE=PATH",
+                        help="weights per mode (default: currency=./best.pt, object=./obj1.pt)")
+    parser.add_argument("--mode", help="mode to start in (default: the first model)")
+    parser.add_argument("--size", default="1280x720", help="camera resolution WxH")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "openvino", "stub"])
+    parser.add_argument("--quantized", nargs="*", default=[], help="modes that use their INT8 model")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--detect-every", type=int, default=1,
+                        help="run the detector every N frames, track in between")
+    parser.add_argument("--no-display", dest="display", action="store_false")
+    parser.add_argument("--video-out", help="write the annotated frames to this video file")
+    parser.add_argument("--audio", action="store_true", help="play clips/speech for new detections")
+    parser.add_argument("--realtime", action="store_true", help="play file sources at their frame rate")
+    parser.add_argument("--loop", action="store_true", help="restart file sources at the end")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--output", help="write the run summary as JSON to this file")
+    args = parser.parse_args()
+
+    models = dict(spec.split("=", 1) for spec in args.model) if args.model else DEFAULT_MODELS
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    runtime = LocalRuntime(models, args.mode, args.source, size, args.backend, args.quantized,
+                           args.threshold, args.detect_every, display=args.display,
+                           video_out=args.video_out, audio=args.audio, realtime=args.realtime,
+                           loop=args.loop)
+    report = runtime.run(args.duration)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
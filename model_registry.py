@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from inference_backends import (get_input_size, load_model, read_weights_info,
+                                remember_weights_info)
+
+# Which model serves which mode lives in a JSON config (MODELS_CONFIG, default
+# ./models.json), so adding a mode such as another currency is a config change:
+#
+#   {
+#     "modes": {
+#       "currency": {"path": "./best.pt"},
+#       "object":   {"path": "./obj1.pt", "backend": "onnx", "quantized": true}
+#     },
+#     "combined": {"both": ["currency", "object"]}
+#   }
+#
+# "backend" and "quantized" are optional per-mode overrides of the server defaults.
+
+DEFAULT_CONFIG = {
+    "modes": {
+        "currency": {"path": "./best.pt"},
+        "object": {"path": "./obj1.pt"},
+    },
+    "combined": {
+        "both": ["currency", "object"],
+    },
+}
+
+def load_config(path):
+    """Read the models config, falling back to DEFAULT_CONFIG when there is no file."""
+    if not os.path.exists(path):
+        print(f"No models config at {path}, using the built-in modes")
+        return DEFAULT_CONFIG
+    with open(path) as f:
+        config = json.load(f)
+    config.setdefault("combined", {})
+    for mode, parts in list(config["combined"].items()):
+        missing = [part for part in parts if part not in config["modes"]]
+        if missing:
+            print(f"Combined mode {mode} refers to unknown modes {missing}, ignoring it")
+            del config["combined"][mode]
+    return config
+
+
+class ModelUnavailable(LookupError):
+    """The mode is not configured, its weights are missing or they failed to load."""
+
+
+class ModelRegistry:
+    """Models by mode, loaded on first use (or up front with preload()).
+
+    At most `max_resident` models stay in memory (0 = no limit); loading one more
+    evicts the least recently used. Class names and input sizes are remembered
+    after a model's first load, in memory and in a sidecar file next to the
+    weights' exports, so describe() works for evicted models and, on later
+    starts, for models that were never loaded.
+    A mode whose weights are missing or fail to load is reported through
+    `errors` and raises ModelUnavailable instead of taking the server down.
+
+    Every load is followed by `warmup_runs` dummy inferences, so the first real
+    frame doesn't pay for lazy allocations and kernel selection; the steady-state
+    time of those runs is kept as the model's warm latency.
+
+    The server gives every inference worker its own registry; several threads
+    may still load different modes concurrently (preload), so state is locked.
+    """
+
+    def __init__(self, specs, backend="torch", max_resident=0, quantized_modes=(), warmup_runs=0):
+        self.specs = specs
+        self.backend = backend
+        self.max_resident = max_resident
+        self.quantized_modes = set(quantized_modes)
+        self.warmup_runs = warmup_runs
+
+        self.models = OrderedDict()  # mode -> model, least recently used first
+        self.info = {}               # mode -> {"classes": [...], "input_size": int}
+        self.errors = {}             # mode -> why it can't be loaded
+        self.status = {mode: "unloaded" for mode in specs}  # loading/warming/ready/evicted/unavailable
+        self.warm_ms = {}            # mode -> inference time after warmup
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._mode_locks = {mode: threading.Lock() for mode in specs}
+
+        for mode, spec in specs.items():
+            if spec.get("backend", backend) != "stub" and not os.path.exists(spec["path"]):
+                self.errors[mode] = f"model file not found: {spec['path']}"
+                self.status[mode] = "unavailable"
+                print(f"Mode {mode} unavailable: {self.errors[mode]}")
+
+    def available(self, mode):
+        return mode in self.specs and mode not in self.errors
+
+    def get(self, mode):
+        """Return the model for `mode`, loading it (and evicting another) if needed."""
+        if not self.available(mode):
+            raise ModelUnavailable(self.errors.get(mode, f"unknown mode: {mode}"))
+        with self._lock:
+            if mode in self.models:
+                self.models.move_to_end(mode)
+                return self.models[mode]
+
+        # One load per mode at a time; other modes can load in parallel
+        with self._mode_locks[mode]:
+            with self._lock:
+                if mode in self.models:
+                    self.models.move_to_end(mode)
+                    return self.models[mode]
+            model = self._load(mode)
+            with self._lock:
+                self.models[mode] = model
+                while self.max_resident and len(self.models) > self.max_resident:
+                    evicted, _ = self.models.popitem(last=False)
+                    self.status[evicted] = "evicted"
+                    self.evictions += 1
+                    print(f"Evicted {evicted} model (max {self.max_resident} resident)")
+            return model
+
+    def preload(self, modes=None):
+        """Load several modes in parallel (all available ones by default).
+
+        With a residency cap only the first `max_resident` modes are loaded.
+        """
+        modes = [m for m in (modes or self.specs) if self.available(m)]
+        if self.max_resident:
+            modes = modes[:self.max_resident]
+        if not modes:
+            return
+        with ThreadPoolExecutor(max_workers=len(modes)) as pool:
+            list(pool.map(self._try_get, modes))
+
+    def describe(self, mode):
+        """Class names and input size of `mode`, loading the model once if needed."""
+        if mode not in self.info and not self._read_sidecar(mode):
+            self.get(mode)
+        return self.info[mode]
+
+    def describe_all(self):
+        """describe() every available mode, loading the unknown ones in parallel."""
+        unknown = [m for m in self.specs if self.available(m) and m not in self.info
+                   and not self._read_sidecar(m)]
+        if unknown:
+            with ThreadPoolExecutor(max_workers=len(unknown)) as pool:
+                list(pool.map(self._try_get, unknown))
+        return {mode: self.info[mode] for mode in self.specs if mode in self.info}
+
+    def model_status(self):
+        """{mode: {"status": ..., "warm_ms": ...}} for every configured mode."""
+        with self._lock:
+            return {mode: {"status": self.status[mode], "warm_ms": self.warm_ms.get(mode)}
+                    for mode in self.specs}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": list(self.models),
+                "max_resident": self.max_resident,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "unavailable": dict(self.errors),
+            }
+
+    def _read_sidecar(self, mode):
+        """Fill info[mode] from the weights' sidecar; False if there is none yet."""
+        spec = self.specs[mode]
+        if spec.get("backend", self.backend) == "stub":
+            return False  # no weights to describe; stub models load instantly anyway
+        info = read_weights_info(spec["path"])
+        if info is None:
+            return False
+        with self._lock:
+            self.info.setdefault(mode, info)
+        return True
+
+    def _try_get(self, mode):
+        try:
+            self.get(mode)
+        except ModelUnavailable:
+            pass
+
+    def _load(self, mode):
+        spec = self.specs[mode]
+        backend = spec.get("backend", self.backend)
+        quantized = spec.get("quantized", mode in self.quantized_modes)
+        print(f"Loading {mode} model from {spec['path']} ({backend}{', int8' if quantized else ''})...")
+        self.status[mode] = "loading"
+        try:
+            model = load_model(spec["path"], backend, quantized)
+            info = {"classes": [model.names[i] for i in range(len(model.names))],
+                    "input_size": get_input_size(model)}
+            if backend != "stub":
+                try:
+                    remember_weights_info(spec["path"], info["classes"], info["input_size"])
+                except (OSError, ValueError) as e:
+                    print(f"Could not store the {mode} model description: {e}")
+            if self.warmup_runs:
+                self.status[mode] = "warming"
+                self.warm_ms[mode] = self._warm_up(model, info["input_size"])
+                print(f"Warmed up {mode} model: {self.warm_ms[mode]} ms per frame")
+        except Exception as e:
+            self.errors[mode] = f"failed to load {spec['path']}: {e}"
+            self.status[mode] = "unavailable"
+            print(f"Mode {mode} unavailable: {self.errors[mode]}")
+            raise ModelUnavailable(self.errors[mode]) from e
+        self.loads += 1
+        self.info[mode] = info
+        self.status[mode] = "ready"
+        return model
+
+    def _warm_up(self, model, input_size):
+        """Run dummy frames through a fresh model; returns the warm latency in ms."""
+        # Same shape as a 16:9 capture shrunk to the input size, like real frames
+        frame = np.zeros((input_size * 9 // 16, input_size, 3), dtype=np.uint8)
+        times = []
+        for _ in range(self.warmup_runs):
+            start = time.perf_counter()
+            model(frame, verbose=False)
+            times.append(time.perf_counter() - start)
+        steady = times[1:] or times  # the first run includes the one-off setup
+        return round(float(np.median(steady)) * 1000, 1)
@@ -0,0 +1,208 @@
+import argparse
+import glob
+import os
+import re
+import time
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                      quantize_static)
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+
+from inference_backends import export_model, get_input_size, quantized_path, write_model_info
+from inference_worker import DETECTION_THRESHOLD, MODEL_PATHS, filter_detections
+from tracker import iou_matrix
+
+# Builds INT8 versions of the detection models from frames captured on the device
+# and checks them against the float models before they are used.
+#
+#   python quantize_models.py --frames ./captured_frames [--modes currency object]
+#
+# For each mode the float model is exported to ONNX, statically quantized with
+# ONNX Runtime (calibrated on part of the frames) and both models are run on the
+# held-out frames. The drift report is stored next to the INT8 model; only models
+# that stay within --min-agreement are marked accepted, and only accepted models
+# are loaded by the server (QUANTIZED_MODES) and the standalone scripts.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+MATCH_IOU = 0.5  # an INT8 box counts as the same detection above this IoU
+
+def list_frames(directory, max_frames):
+    paths = sorted(p for p in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))
+    if max_frames and len(paths) > max_frames:
+        # Spread the sample over the whole recording instead of taking the start
+        step = len(paths) / max_frames
+        paths = [paths[int(i * step)] for i in range(max_frames)]
+    return paths
+
+def split_frames(paths, eval_fraction):
+    """Hold out every k-th frame for evaluation, calibrate on the rest."""
+    if len(paths) < 10:
+        print(f"Only {len(paths)} frames: calibrating and evaluating on the same frames")
+        return paths, paths
+    every = max(2, round(1 / eval_fraction))
+    evaluation = paths[::every]
+    calibration = [p for i, p in enumerate(paths) if i % every]
+    return calibration, evaluation
+
+class FrameReader(CalibrationDataReader):
+    """Feeds calibration frames preprocessed exactly like ultralytics predict does."""
+
+    def __init__(self, paths, input_name, imgsz):
+        self.paths = iter(paths)
+        self.input_name = input_name
+        self.letterbox = LetterBox((imgsz, imgsz), auto=False)
+
+    def get_next(self):
+        for path in self.paths:
+            frame = cv2.imread(path)
+            if frame is None:
+                continue
+            image = self.letterbox(image=frame)
+            image = image[:, :, ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+            image = np.ascontiguousarray(image, dtype=np.float32)[None] / 255.0
+            return {self.input_name: image}
+        return None
+
+def head_nodes(model):
+    """Nodes of the final detection layer; quantizing its box/score decoding costs
+    the most accuracy for the least speed, so it stays in float."""
+    layers = {}
+    for node in model.graph.node:
+        match = re.match(r"^/model\.(\d+)/", node.name)
+        if match:
+            layers.setdefault(int(match.group(1)), []).append(node.name)
+    return layers[max(layers)] if layers else []
+
+def quantize(float_path, int8_path, calibration, imgsz, keep_head_float=True):
+    model = onnx.load(float_path)
+    input_name = model.graph.input[0].name
+    exclude = head_nodes(model) if keep_head_float else []
+    quantize_static(float_path, int8_path, FrameReader(calibration, input_name, imgsz),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    nodes_to_exclude=exclude)
+
+    # Carry over the ultralytics metadata (class names, stride, imgsz) so the
+    # INT8 model loads through YOLO() like the float export
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, int8_path)
+
+def run_model(model, paths, threshold):
+    detections, seconds = [], []
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        start = time.perf_counter()
+        results = model(frame, verbose=False)[0]
+        seconds.append(time.perf_counter() - start)
+        detections.append(filter_detections(results, threshold))
+    # The first call includes session setup, leave it out of the latency
+    latency = np.mean(seconds[1:] if len(seconds) > 1 else seconds) * 1000
+    return detections, latency
+
+def compare(reference, candidate):
+    """Drift of candidate detections against the float model's, frame by frame."""
+    matched = ref_total = cand_total = top_agree = frames_with_dets = 0
+    ious, score_deltas = [], []
+    for ref, cand in zip(reference, candidate):
+        ref_total += len(ref)
+        cand_total += len(cand)
+        if len(ref) or len(cand):
+            frames_with_dets += 1
+            top_ref = int(ref[ref[:, 4].argmax(), 5]) if len(ref) else None
+            top_cand = int(cand[cand[:, 4].argmax(), 5]) if len(cand) else None
+            top_agree += top_ref == top_cand
+
+        overlap = iou_matrix(ref, cand)
+        for i in range(len(ref)):
+            overlap[i, cand[:, 5] != ref[i, 5]] = 0  # same class only
+        used = set()
+        for i in np.argsort(-ref[:, 4]) if len(ref) else []:
+            order = [j for j in np.argsort(-overlap[i]) if j not in used]
+            if order and overlap[i, order[0]] >= MATCH_IOU:
+                j = order[0]
+                used.add(j)
+                matched += 1
+                ious.append(float(overlap[i, j]))
+                score_deltas.append(float(abs(ref[i, 4] - cand[j, 4])))
+
+    return {
+        "recall": matched / ref_total if ref_total else 1.0,
+        "precision": matched / cand_total if cand_total else 1.0,
+        "top_label_agreement": top_agree / frames_with_dets if frames_with_dets else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "mean_score_delta": float(np.mean(score_deltas)) if score_deltas else None,
+        "float_detections": ref_total,
+        "int8_detections": cand_total,
+    }
+
+def quantize_mode(mode, weights_path, calibration, evaluation, args):
+    print(f"\n=== {mode}: {weights_path} ===")
+    float_model = YOLO(weights_path)
+    imgsz = get_input_size(float_model)
+    float_onnx = export_model(weights_path, "onnx")
+    int8_path = quantized_path(weights_path)
+
+    print(f"Quantizing on {len(calibration)} frames...")
+    quantize(float_onnx, int8_path, calibration, imgsz, not args.quantize_head)
+
+    print(f"Evaluating on {len(evaluation)} frames...")
+    reference, float_ms = run_model(float_model, evaluation, args.threshold)
+    candidate, int8_ms = run_model(YOLO(int8_path, task="detect"), evaluation, args.threshold)
+    report = compare(reference, candidate)
+    report.update({"float_ms": round(float_ms, 2), "int8_ms": round(int8_ms, 2),
+                   "speedup": round(float_ms / int8_ms, 2) if int8_ms else None})
+
+    accepted = min(report["recall"], report["precision"],
+                   report["top_label_agreement"]) >= args.min_agreement
+    write_model_info(int8_path, {
+        "imgsz": imgsz,
+        "weights": os.path.abspath(weights_path),
+        "accepted": accepted,
+        "min_agreement": args.min_agreement,
+        "calibration_frames": len(calibration),
+        "evaluation_frames": len(evaluation),
+        "report": report,
+    })
+
+    for key, value in report.items():
+        print(f"  {key:20s} {value:.3f}" if isinstance(value, float) else f"  {key:20s} {value}")
+    if accepted:
+        print(f"ACCEPTED: {int8_path}")
+    else:
+        print(f"REJECTED (agreement below {args.min_agreement}): the float model stays in use")
+    return accepted
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and check INT8 versions of the models")
+    parser.add_argument("--frames", required=True, help="directory of captured frames")
+    parser.add_argument("--modes", nargs="+", default=list(MODEL_PATHS), choices=list(MODEL_PATHS))
+    parser.add_argument("--max-frames", type=int, default=300)
+    parser.add_argument("--eval-fraction", type=float, default=0.3,
+                        help="share of frames held out for the drift report")
+    parser.add_argument("--threshold", type=float, default=DETECTION_THRESHOLD)
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="minimum recall, precision and top-label agreement vs float")
+    parser.add_argument("--quantize-head", action="store_true",
+                        help="also quantize the final detection layer")
+    args = parser.parse_args()
+
+    paths = list_frames(args.frames, args.max_frames)
+    if not paths:
+        raise SystemExit(f"No images found in {args.frames}")
+    calibration, evaluation = split_frames(paths, args.eval_fraction)
+
+    results = {mode: quantize_mode(mode, MODEL_PATHS[mode], calibration, evaluation, args)
+               for mode in args.modes}
+    print("\nSummary: " + ", ".join(f"{mode}={'accepted' if ok else 'rejected'}"
+                                    for mode, ok in results.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+from image_hash import hamming
+
+
+class ResultCache:
+    """LRU cache of detections keyed by (mode, frame shape) plus a perceptual frame hash.
+
+    A lookup hits when a cached hash of the same mode and frame shape is within
+    `max_distance` bits, so near-duplicate frames (same scene, sensor noise,
+    JPEG artefacts) reuse the earlier detections without running the model.
+    The cache is bounded by entry count and by the bytes held in detection
+    arrays, and entries expire after `ttl` seconds. Safe to share between
+    threads.
+    """
+
+    # Rough per-entry overhead (key tuple, hash int, OrderedDict slot) on top of the array
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_entries=256, max_bytes=4 * 1024 * 1024, ttl=2.0, max_distance=8):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_distance = max_distance
+
+        self._entries = OrderedDict()  # (mode, shape, hash) -> (detections, stored_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mode, shape, frame_hash):
+        """Return cached detections for a near-identical frame, or None."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            key = (mode, shape, frame_hash)
+            if key not in self._entries:
+                key = self._nearest(mode, shape, frame_hash)
+            if key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, mode, shape, frame_hash, detections):
+        key = (mode, shape, frame_hash)
+        size = detections.nbytes + self.ENTRY_OVERHEAD
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (detections, time.time(), size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _nearest(self, mode, shape, frame_hash):
+        best_key, best_distance = None, self.max_distance + 1
+        for key in self._entries:
+            if key[0] != mode or key[1] != shape:
+                continue
+            distance = hamming(frame_hash, key[2])
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def _expire(self, now):
+        # Entries are in LRU order, not insertion order, so check them all
+        expired = [key for key, (_, stored_at, _) in self._entries.items()
+                   if now - stored_at > self.ttl]
+        for key in expired:
+            self._remove(key)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
@@ -1,35 +1,414 @@
-import cv2
-import numpy as np
+import os
+import time
 import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from ultralytics import YOLO
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import json
+import numpy as np
+
+import inference_worker
+import server_metrics as metrics
+from batch_scheduler import BatchScheduler
+from model_registry import ModelUnavailable
+from shm_workers import SharedMemoryWorkers
+from tracker import IoUTracker
+from ws_protocol import RESULT_FORMATS, detections_to_json, encode_results, unpack_frame
 
 app = FastAPI()
 
-# -------------------- Model Setup --------------------
-# Load models once at startup
-print("Loading YOLO models...")
-try:
-    currency_model = YOLO("./best.pt")
-    object_model = YOLO("./obj1.pt") # Or 'yolo11n.pt' or check path
-    # Pre-warm models if needed
-    print("Models loaded successfully.")
-except Exception as e:
-    print(f"Error loading models: {e}")
-    # Fallback to standard model if custom ones aren't found for testing purposes?
-    # For now, we assume files exist as seen in list_dir.
-
-currency_classes = currency_model.names
-object_classes = object_model.names
+# -------------------- Configuration --------------------
+# Frames from all connections are grouped per mode into one model call.
+# A batch is sent as soon as it is full or the oldest frame has waited this long.
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+# Decode + inference + postprocess run in this pool; the event loop only does I/O.
+# "thread" shares one process (torch releases the GIL during inference),
+# "process" gives every worker its own interpreter. Each worker loads its own models.
+# "shm" is worker processes too, but frames are decoded here into shared memory
+# and the workers read the pixels in place (see shm_workers.py); it scales with
+# the cores, so set INFERENCE_WORKERS to about the core count.
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Torch intra-op threads per worker, so workers don't oversubscribe the cores
+TORCH_THREADS_PER_WORKER = int(os.environ.get("TORCH_THREADS_PER_WORKER",
+                                              max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS)))
+# Shared memory frame slots for INFERENCE_EXECUTOR=shm: enough for every worker to
+# have a full batch running and the next one queued. Frames that are too large or
+# find no slot free fall back to bytes (decoded in the worker, off the front end)
+SHM_SLOTS = int(os.environ.get("SHM_SLOTS", INFERENCE_WORKERS * BATCH_MAX_SIZE * 2))
+SHM_SLOT_BYTES = int(os.environ.get("SHM_SLOT_BYTES", 1280 * 720 * 3))
+DECODE_THREADS = int(os.environ.get("DECODE_THREADS", max(2, (os.cpu_count() or 2) // 4)))
+# Frames a single connection may have in inference at once (pipelined clients)
+MAX_INFLIGHT_PER_CONNECTION = int(os.environ.get("MAX_INFLIGHT_PER_CONNECTION", 4))
+# Default ingestion per connection (clients can switch with "INGEST:<mode>"):
+# "fifo" processes every frame in arrival order, "latest" keeps only the newest
+# frame waiting for a free slot and drops older ones before they are decoded.
+INGEST_MODE = os.environ.get("INGEST_MODE", "fifo")
+INGEST_MODES = ["fifo", "latest"]
+# Default result format per connection (clients can switch with "FORMAT:<format>")
+RESULT_FORMAT = os.environ.get("RESULT_FORMAT", "json")
+# Single-model modes plus combined modes ("both" runs currency and object together)
+MODES = list(inference_worker.MODEL_PATHS) + list(inference_worker.COMBINED_MODES)
+# New connections start in DEFAULT_MODE. /readyz stays 503 until every mode in
+# REQUIRED_MODES (comma-separated, default: DEFAULT_MODE) can be served.
+DEFAULT_MODE = "currency"
+REQUIRED_MODES = [m for m in os.environ.get("REQUIRED_MODES", DEFAULT_MODE).split(",") if m]
+# Connections that send "TRACK:on" get the detector on every Nth frame only (or
+# sooner when a track's score decays below TRACK_MIN_SCORE); frames in between
+# skip decode and inference and get the tracked boxes moved on by their velocity.
+TRACK_DETECT_EVERY = int(os.environ.get("TRACK_DETECT_EVERY", 5))
+TRACK_MIN_SCORE = float(os.environ.get("TRACK_MIN_SCORE", 0.35))
+
+# -------------------- Inference Executor --------------------
+executor = None
+class_names = {}  # mode -> [class name by id], sent to clients in the hello event
+class_sources = {}  # combined mode -> [source mode by class id], tags merged detections
+input_sizes = {}  # mode -> model input size, so clients can shrink frames before encoding
+unavailable = {}  # mode -> why it can't be served (missing weights, failed load)
+
+def create_executor():
+    """Create the pool that owns the models and runs all CPU-bound work."""
+    if INFERENCE_EXECUTOR == "shm":
+        if SHM_SLOTS < INFERENCE_WORKERS * BATCH_MAX_SIZE:
+            print(f"Warning: SHM_SLOTS={SHM_SLOTS} can't hold a full batch per worker "
+                  f"({INFERENCE_WORKERS} x {BATCH_MAX_SIZE}); the rest are decoded in the workers")
+        pool = SharedMemoryWorkers(INFERENCE_WORKERS, TORCH_THREADS_PER_WORKER,
+                                   SHM_SLOTS, SHM_SLOT_BYTES, DECODE_THREADS)
+        pool.start()
+        return pool
+    pool_class = ProcessPoolExecutor if INFERENCE_EXECUTOR == "process" else ThreadPoolExecutor
+    print(f"Starting {INFERENCE_WORKERS} {INFERENCE_EXECUTOR} inference workers...")
+    return pool_class(max_workers=INFERENCE_WORKERS,
+                      initializer=inference_worker.init_worker,
+                      initargs=(TORCH_THREADS_PER_WORKER,))
+
+async def call_worker(func, *args):
+    """Run an inference_worker function in the executor (any worker)."""
+    if INFERENCE_EXECUTOR == "shm":
+        return await executor.call(func.__name__, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+cache_counters = {"hits": 0, "misses": 0}
+
+async def run_batch(mode, items):
+    """Decode and run a batch of (jpeg, source_size, queued_at) items in the executor."""
+    payloads = [(data, source_size) for data, source_size, _ in items]
+    if INFERENCE_EXECUTOR == "shm":
+        batch = await executor.process_batch(mode, payloads, input_sizes.get(mode, 0))
+    else:
+        batch = await call_worker(inference_worker.process_batch, mode, payloads,
+                                  input_sizes.get(mode, 0))
+    cache_counters["hits"] += batch["cache_hits"]
+    cache_counters["misses"] += batch["cache_misses"]
+    metrics.CACHE_LOOKUPS.labels("hit").inc(batch["cache_hits"])
+    metrics.CACHE_LOOKUPS.labels("miss").inc(batch["cache_misses"])
+    metrics.observe_batch(mode, batch["timings"], [queued_at for _, _, queued_at in items])
+    return batch["detections"]
+
+scheduler = BatchScheduler(run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                           max_concurrent_batches=INFERENCE_WORKERS)
+
+# Queue depths are read when /metrics is scraped
+for _mode in MODES:
+    metrics.QUEUE_DEPTH.labels("batch", _mode).set_function(
+        lambda mode=_mode: scheduler.queue_depth(mode))
+metrics.QUEUE_DEPTH.labels("executor", "all").set_function(scheduler.inflight_batches)
+latest_slots = set()  # LatestFrameSlot of every open connection
+metrics.QUEUE_DEPTH.labels("latest", "all").set_function(
+    lambda: sum(slot.item is not None for slot in latest_slots))
+
+# -------------------- Startup / Readiness --------------------
+# Models load and warm up in the background after the port opens: /healthz
+# answers right away, /readyz only once every worker has its models warm
+# (MODEL_LOAD=lazy: once every worker is up; models then load on first use)
+# and the REQUIRED_MODES can be served. WebSocket clients that connect earlier
+# wait for startup to end before the hello, and are closed if it failed.
+ready = asyncio.Event()
+startup_done = asyncio.Event()  # set when startup ends, whether or not it succeeded
+startup = {"started_at": time.time(), "ready_at": None, "error": None, "workers": []}
+
+async def check_workers():
+    """Run worker_status once on every worker; returns their model statuses."""
+    if INFERENCE_EXECUTOR == "shm":
+        # Tasks can be sent to a given worker, no barrier needed
+        return await asyncio.gather(*[executor.call("worker_status", worker=i)
+                                      for i in range(INFERENCE_WORKERS)])
+    loop = asyncio.get_running_loop()
+    manager = multiprocessing.Manager() if INFERENCE_EXECUTOR == "process" else None
+    barrier = manager.Barrier(INFERENCE_WORKERS) if manager else threading.Barrier(INFERENCE_WORKERS)
+    try:
+        return await asyncio.gather(*[loop.run_in_executor(executor, inference_worker.worker_status,
+                                                           barrier)
+                                      for _ in range(INFERENCE_WORKERS)])
+    finally:
+        if manager:
+            manager.shutdown()
+
+async def prepare_models():
+    global class_names, class_sources, input_sizes, unavailable
+    try:
+        info = await call_worker(inference_worker.get_model_info)
+        class_names, class_sources, input_sizes = info["classes"], info["sources"], info["input_sizes"]
+        unavailable = info["unavailable"]
+        for mode, reason in unavailable.items():
+            print(f"Mode {mode} unavailable: {reason}")
+        startup["workers"] = await check_workers()
+    except Exception as e:
+        startup["error"] = str(e)
+        print(f"Startup failed: {e}")
+        startup_done.set()
+        return
+    startup["ready_at"] = time.time()
+    print(f"Ready after {startup['ready_at'] - startup['started_at']:.1f}s")
+    for mode, reason in missing_modes().items():
+        print(f"Required mode {mode} can't be served ({reason}): /readyz will stay 503")
+    ready.set()
+    startup_done.set()
+
+def missing_modes():
+    """REQUIRED_MODES that can't be served, with the reason."""
+    return {mode: unavailable.get(mode, "not loaded" if mode in MODES else "unknown mode")
+            for mode in REQUIRED_MODES if mode in unavailable or mode not in class_names}
+
+def model_readiness():
+    """Per-mode status and warm latency across workers (slowest worker's latency)."""
+    models = {}
+    for worker in startup["workers"]:
+        for mode, state in worker["models"].items():
+            entry = models.setdefault(mode, {"status": {}, "warm_ms": None})
+            entry["status"][state["status"]] = entry["status"].get(state["status"], 0) + 1
+            if state["warm_ms"] is not None:
+                entry["warm_ms"] = max(entry["warm_ms"] or 0, state["warm_ms"])
+    return models
+
+@app.on_event("startup")
+async def start_executor():
+    global executor
+    executor = create_executor()
+    asyncio.create_task(prepare_models())
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    await scheduler.close()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the event loop is responsive. Doesn't wait for the models."""
+    return {"status": "ok", "uptime_s": round(time.time() - startup["started_at"], 1),
+            "loading": not startup_done.is_set(), "error": startup["error"]}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once every worker has loaded and warmed its models and the
+    REQUIRED_MODES can be served, else 503 ("missing" says which aren't and why).
+
+    With MODEL_LOAD=lazy it is 200 once the workers are up: "models" then shows
+    which ones are still unloaded, and their first frames pay for the load.
+    """
+    missing = missing_modes() if ready.is_set() else {}
+    is_ready = ready.is_set() and not missing
+    body = {"ready": is_ready, "load": inference_worker.MODEL_LOAD,
+            "workers": len(startup["workers"]), "models": model_readiness(),
+            "unavailable": unavailable, "missing": missing, "error": startup["error"]}
+    if startup["ready_at"]:
+        body["startup_s"] = round(startup["ready_at"] - startup["started_at"], 1)
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage latency histograms, connections, queue depths, frames/s."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    """Result cache hit/miss counters across all workers, for tuning CACHE_MAX_DISTANCE."""
+    lookups = cache_counters["hits"] + cache_counters["misses"]
+    stats = dict(cache_counters, hit_rate=cache_counters["hits"] / lookups if lookups else 0.0,
+                 enabled=inference_worker.CACHE_ENABLED,
+                 max_distance=inference_worker.CACHE_MAX_DISTANCE)
+    if INFERENCE_EXECUTOR == "thread":
+        # Threads share one cache, so its size is the server's cache size
+        cache = inference_worker.cache_stats()
+        stats.update(entries=cache["entries"], bytes=cache["bytes"])
+    return stats
+
+@app.get("/stats/models")
+async def get_model_stats():
+    """Resident models and load/eviction counters (of the worker that answers)."""
+    stats = await call_worker(inference_worker.registry_stats)
+    return dict(stats, unavailable=unavailable, load=inference_worker.MODEL_LOAD)
+
+# -------------------- Ingestion --------------------
+class LatestFrameSlot:
+    """Holds only the newest undecoded frame waiting for an inference slot."""
+
+    def __init__(self):
+        self.item = None
+        self.dropped = 0
+
+    def put(self, item):
+        if self.item is not None:
+            self.dropped += 1
+            metrics.FRAMES.labels(self.item[3], "dropped").inc()
+        self.item = item
+
+    def take(self):
+        item, self.item = self.item, None
+        return item
 
 @app.websocket("/ws/detect")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("Client connected")
+    # Clients that connect while the models are still warming up wait here
+    await startup_done.wait()
+    if startup["error"]:
+        await websocket.send_json({"event": "startup_failed", "error": startup["error"]})
+        await websocket.close(code=1011)
+        return
     
     # Default mode
-    mode = "currency"
+    mode = DEFAULT_MODE
+    ingest = INGEST_MODE
+    result_format = RESULT_FORMAT
+    tracker = None  # IoUTracker while tracking is on (for the current mode only)
+    # While tracking, every frame waits for the frame before it to reply before it
+    # touches the tracker or replies itself: tracked frames (no inference, fast)
+    # can't overtake a detector frame, and the tracker sees frames in order.
+    # Detector frames still run their inference concurrently.
+    previous_reply = None  # future done once the last tracked-mode frame has replied
+
+    # Pipelined clients keep several frames in flight, so each frame is handled in
+    # its own task. Responses carry the frame id and may arrive out of order
+    # (in order while tracking is on).
+    inflight = asyncio.Semaphore(MAX_INFLIGHT_PER_CONNECTION)
+    send_lock = asyncio.Lock()
+    tasks = set()
+    latest = LatestFrameSlot()
+
+    async def send(payload):
+        async with send_lock:
+            if isinstance(payload, bytes):
+                await websocket.send_bytes(payload)
+            else:
+                await websocket.send_json(payload)
+
+    async def reply(payload, frame_mode, received_at, outcome="answered"):
+        start = time.perf_counter()
+        await send(payload)
+        metrics.observe_stage("send", frame_mode, time.perf_counter() - start)
+        metrics.observe_stage("total", frame_mode, time.time() - received_at)
+        metrics.FRAMES.labels(frame_mode, outcome).inc()
+        metrics.frame_rate.mark()
+
+    async def wait_turn(previous):
+        if previous is not None:
+            await asyncio.wait([previous])  # not `await previous`: a cancel must not spread
+
+    async def handle_frame(frame_id, data, source_size, frame_mode, received_at):
+        nonlocal previous_reply
+        metrics.INFLIGHT_FRAMES.inc()
+        metrics.observe_stage("receive", frame_mode, time.time() - received_at)
+        # A frame sent before a mode switch must not touch the new mode's tracker:
+        # its class ids belong to the old model's class table
+        track = tracker if frame_mode == mode else None
+        previous = replied = None
+        if tracker is not None:
+            previous, replied = previous_reply, asyncio.get_running_loop().create_future()
+            previous_reply = replied
+        detecting = False
+        try:
+            outcome = "answered"
+            if track is not None and not track.needs_detection(TRACK_DETECT_EVERY, TRACK_MIN_SCORE):
+                # Between detector frames: no decode, no inference
+                await wait_turn(previous)
+                if track is tracker and frame_mode == mode:
+                    detections = track.predict()
+                else:
+                    # Mode or tracking changed while waiting: nothing to say for this frame
+                    detections = np.zeros((0, 7), dtype=np.float32)
+                outcome = "tracked"
+            else:
+                if track is not None:
+                    # Frames arriving before this result are tracked, not detected again
+                    track.start_detection()
+                    detecting = True
+                # Decode + Inference run in the executor, batched with other connections
+                detections = await scheduler.submit(frame_mode, (data, source_size, time.time()))
+                await wait_turn(previous)
+                if detections is None:
+                    if track is not None:
+                        track.cancel_detection()
+                    if frame_id is not None:
+                        # Tell pipelined clients so the frame doesn't hold a window slot
+                        await reply({"frame_id": frame_id, "detections": [], "mode": frame_mode,
+                                     "error": "decode_failed"}, frame_mode, received_at, "decode_failed")
+                    return
+                if track is not None and track is tracker and frame_mode == mode:
+                    detections = track.update(detections)
+
+            if result_format == "binary":
+                await reply(encode_results(frame_id, MODES.index(frame_mode), latest.dropped, detections),
+                            frame_mode, received_at, outcome)
+                return
+
+            # Send back results as JSON
+            response = {"detections": detections_to_json(detections, class_names[frame_mode],
+                                                         class_sources.get(frame_mode)),
+                        "mode": frame_mode}
+            if frame_id is not None:
+                response["frame_id"] = frame_id
+            if ingest == "latest":
+                response["dropped"] = latest.dropped
+            await reply(response, frame_mode, received_at, outcome)
+        except ModelUnavailable as e:
+            # The model failed to load on first use; answer so the client isn't left waiting
+            if detecting:
+                track.cancel_detection()
+            unavailable.setdefault(frame_mode, str(e))
+            await reply({"frame_id": frame_id, "detections": [], "mode": frame_mode,
+                         "error": "model_unavailable"}, frame_mode, received_at, "model_unavailable")
+        except Exception as e:
+            print(f"Frame error: {e}")
+            if detecting:
+                track.cancel_detection()
+            if frame_id is not None:
+                # Answer anyway, so the frame doesn't hold the client's window slot until it times out
+                try:
+                    await reply({"frame_id": frame_id, "detections": [], "mode": frame_mode,
+                                 "error": "frame_error"}, frame_mode, received_at, "error")
+                except Exception:
+                    metrics.FRAMES.labels(frame_mode, "error").inc()  # connection gone too
+            else:
+                metrics.FRAMES.labels(frame_mode, "error").inc()
+        finally:
+            if replied is not None:
+                # Only after the reply went out, so the next frame's reply follows it
+                replied.set_result(None)
+            metrics.INFLIGHT_FRAMES.dec()
+            inflight.release()
+            # A newer frame may have been waiting for this slot
+            if latest.item is not None and not inflight.locked():
+                await inflight.acquire()
+                start_frame(*latest.take())
+
+    def start_frame(frame_id, data, source_size, frame_mode, received_at):
+        task = asyncio.create_task(handle_frame(frame_id, data, source_size, frame_mode, received_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    # Sent once: class tables let binary results carry class ids only (sources map
+    # combined-mode class ids to their model), input sizes let clients shrink
+    # frames to what the model actually uses before encoding
+    await send({"event": "hello", "modes": MODES, "classes": class_names, "sources": class_sources,
+                "input_sizes": input_sizes, "formats": RESULT_FORMATS, "unavailable": unavailable})
+    latest_slots.add(latest)
+    metrics.ACTIVE_CONNECTIONS.inc()
     
     try:
         while True:
@@ -38,63 +417,62 @@ async def websocket_endpoint(websocket: WebSocket):
             
             # We need to handle both. easiest is to assume binary is image, text is command.
             message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            if "bytes" in message:
-                data = message["bytes"]
-                
-                # Convert bytes to numpy array
-                nparr = np.frombuffer(data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                
-                if frame is None:
+            if message.get("bytes") is not None:
+                received_at = time.time()
+                frame_id, source_size, data = unpack_frame(message["bytes"])
+
+                if ingest == "latest" and inflight.locked():
+                    # Busy: keep only the newest frame, stale ones are never decoded
+                    latest.put((frame_id, data, source_size, mode, received_at))
                     continue
 
-                # Run Inference
-                results = None
-                class_dict = {}
-                
-                if mode == "currency":
-                    results = currency_model(frame, verbose=False)[0]
-                    class_dict = currency_classes
-                else:
-                    results = object_model(frame, verbose=False)[0]
-                    class_dict = object_classes
-                
-                detections = []
-                threshold = 0.5
-                
-                # Process results
-                if results:
-                    for box in results.boxes.data.tolist():
-                        x1, y1, x2, y2, score, class_id = box
-                        if score >= threshold:
-                            label = class_dict[int(class_id)]
-                            detections.append({
-                                "label": label,
-                                "score": float(score),
-                                "box": [float(x1), float(y1), float(x2), float(y2)]
-                            })
-                
-                # Send back results as JSON
-                await websocket.send_json({
-                    "detections": detections,
-                    "mode": mode
-                })
+                # Waiting here applies back-pressure to the client's socket
+                await inflight.acquire()
+                start_frame(frame_id, data, source_size, mode, received_at)
                 
-            elif "text" in message:
+            elif message.get("text") is not None:
                 text = message["text"]
                 if text.startswith("MODE:"):
                     new_mode = text.split(":")[1]
-                    if new_mode in ["currency", "object"]:
+                    if new_mode in class_names:
                         mode = new_mode
+                        if tracker is not None:
+                            tracker.reset()
                         print(f"Mode switched to: {mode}")
                         # Acknowledge mode change
-                        await websocket.send_json({"event": "mode_changed", "mode": mode})
+                        await send({"event": "mode_changed", "mode": mode})
+                    else:
+                        await send({"event": "mode_unavailable", "mode": new_mode,
+                                    "error": unavailable.get(new_mode, "unknown mode")})
+                elif text.startswith("INGEST:"):
+                    new_ingest = text.split(":")[1]
+                    if new_ingest in INGEST_MODES:
+                        ingest = new_ingest
+                        print(f"Ingestion switched to: {ingest}")
+                        await send({"event": "ingest_changed", "ingest": ingest})
+                elif text.startswith("FORMAT:"):
+                    new_format = text.split(":")[1]
+                    if new_format in RESULT_FORMATS:
+                        result_format = new_format
+                        print(f"Result format switched to: {result_format}")
+                        await send({"event": "format_changed", "format": result_format})
+                elif text.startswith("TRACK:"):
+                    tracker = IoUTracker() if text.split(":")[1] == "on" else None
+                    print(f"Tracking {'on' if tracker else 'off'}")
+                    await send({"event": "tracking_changed", "tracking": tracker is not None})
 
     except WebSocketDisconnect:
         print("Client disconnected")
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        metrics.ACTIVE_CONNECTIONS.dec()
+        latest_slots.discard(latest)
+        for task in tasks:
+            task.cancel()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,79 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics of the inference server, exposed on /metrics.
+#
+# inference_stage_seconds{stage, mode} follows a frame through the server:
+#   receive      message arrived -> frame task started (waiting for an inflight slot)
+#   queue        frame task started -> its batch started in a worker (scheduler + executor)
+#   decode       cv2.imdecode, per frame
+#   cache        frame hashing and result cache lookups, per batch
+#   inference    model call, per batch and per source model
+#   postprocess  threshold filtering, merging and box rescaling, per batch
+#   send         websocket send of the reply
+#   total        message arrived -> reply sent
+# Tracked frames that skip the detector only get receive, send and total.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1,
+                   0.15, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STAGE_SECONDS = Histogram("inference_stage_seconds", "Time spent per frame processing stage",
+                          ["stage", "mode"], buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("inference_batch_size", "Frames per model batch", ["mode"],
+                       buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+FRAMES = Counter("inference_frames_total", "Frames by outcome", ["mode", "outcome"])
+CACHE_LOOKUPS = Counter("inference_cache_lookups_total", "Result cache lookups", ["result"])
+
+ACTIVE_CONNECTIONS = Gauge("inference_active_connections", "Open /ws/detect connections")
+INFLIGHT_FRAMES = Gauge("inference_inflight_frames", "Frames between receive and reply")
+QUEUE_DEPTH = Gauge("inference_queue_depth", "Items waiting in a server queue", ["queue", "mode"])
+FRAMES_PER_SECOND = Gauge("inference_frames_per_second",
+                          "Replies sent per second over the last few seconds")
+
+
+class RateMeter:
+    """Events per second over a sliding window (for the frames/s gauge).
+
+    Counts go into one bucket per second in a fixed ring, so memory stays the
+    same however many events are marked between scrapes.
+    """
+
+    def __init__(self, window=5):
+        self.window = int(window)
+        self.counts = [0] * self.window
+        self.seconds = [-1] * self.window  # which second each bucket is counting
+
+    def mark(self):
+        second = int(time.time())
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def rate(self):
+        now = int(time.time())
+        return sum(count for count, second in zip(self.counts, self.seconds)
+                   if now - second < self.window) / self.window
+
+
+frame_rate = RateMeter()
+FRAMES_PER_SECOND.set_function(frame_rate.rate)
+
+def observe_stage(stage, mode, seconds):
+    STAGE_SECONDS.labels(stage, mode).observe(seconds)
+
+def observe_batch(mode, timings, queued_at):
+    """Record the worker-side timings returned by inference_worker.process_batch.
+
+    `queued_at` holds each frame's wall-clock submit time, for the queue stage.
+    """
+    for submitted in queued_at:
+        observe_stage("queue", mode, max(0.0, timings["started"] - submitted))
+    for seconds in timings["decode"]:
+        observe_stage("decode", mode, seconds)
+    observe_stage("cache", mode, timings["cache"])
+    for source, seconds in timings["inference"].items():
+        observe_stage("inference", source, seconds)
+    observe_stage("postprocess", mode, timings["postprocess"])
+    BATCH_SIZE.labels(mode).observe(len(queued_at))
@@ -0,0 +1,230 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import cv2
+import numpy as np
+
+# Session recording and replay.
+#
+# A session is two append-only files:
+#   <path>.frames  the record payloads back to back (raw pixels, JPEG bytes or
+#                  a JSON server response)
+#   <path>.index   a small header followed by one fixed-size INDEX_DTYPE entry
+#                  per record: where its payload is, what it is, when it was taken
+#
+# The wearable records while it streams (SessionRecorder); SessionReader
+# memory-maps both files, so replaying a long session neither loads it into
+# memory nor copies raw frames. ReplaySource plays a session back through the
+# Picamera2 capture API, so detection loops run on it unchanged.
+
+INDEX_MAGIC = b"VSSESS01"
+INDEX_HEADER = struct.Struct("<8sI4x")  # magic, version, padding to 16 bytes
+INDEX_VERSION = 1
+
+KIND_RAW = 0       # captured frame, uint8 array of shape (height, width, channels)
+KIND_JPEG = 1      # encoded frame as sent to the server; height/width are the capture size
+KIND_RESPONSE = 2  # server reply as JSON; frame_id is the frame it answers
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("kind", "u1"),
+    ("channels", "u1"),
+    ("height", "<u2"),
+    ("width", "<u2"),
+    ("timestamp", "<f8"),
+    ("frame_id", "<i8"),  # -1 for frames that were captured but not sent
+])
+
+
+class SessionRecorder:
+    """Appends frames and responses to a session from a background writer thread.
+
+    Calls only queue the record, so the capture/send path never waits on disk.
+    If the disk falls behind and `max_pending` records are waiting, new records
+    are dropped (and counted) rather than stalling the camera.
+    """
+
+    def __init__(self, path, max_pending=256):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.dropped = 0
+        self.written = 0
+        self._data = open(path + ".frames", "ab")
+        self._index = open(path + ".index", "ab")
+        if self._index.tell() == 0:
+            self._index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+        self._offset = self._data.tell()
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def record_raw(self, frame, frame_id=-1, timestamp=None):
+        """Record a captured frame before encoding (pixels as captured)."""
+        h, w = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        self._put(KIND_RAW, np.ascontiguousarray(frame).tobytes(), (h, w, channels),
+                  timestamp, frame_id)
+
+    def record_jpeg(self, jpeg, source_size, frame_id=-1, timestamp=None):
+        """Record an encoded frame; `source_size` (w, h) is the captured size."""
+        self._put(KIND_JPEG, bytes(jpeg), (source_size[1], source_size[0], 3), timestamp, frame_id)
+
+    def record_response(self, frame_id, data, timestamp=None):
+        """Record the server's reply to a frame (any JSON-serialisable dict)."""
+        payload = json.dumps(data, separators=(",", ":")).encode()
+        self._put(KIND_RESPONSE, payload, (0, 0, 0), timestamp, frame_id)
+
+    def close(self):
+        """Write everything still queued and close the files."""
+        self._queue.put(None)
+        self._thread.join()
+        self._data.close()
+        self._index.close()
+
+    def _put(self, kind, payload, shape, timestamp, frame_id):
+        record = (kind, payload, shape, time.time() if timestamp is None else timestamp,
+                  -1 if frame_id is None else frame_id)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        entry = np.zeros(1, dtype=INDEX_DTYPE)
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            kind, payload, (h, w, channels), timestamp, frame_id = record
+            self._data.write(payload)
+            entry[0] = (self._offset, len(payload), kind, channels, h, w, timestamp, frame_id)
+            self._offset += len(payload)
+            # Payload first, then its index entry: a crash never indexes missing bytes
+            self._data.flush()
+            self._index.write(entry.tobytes())
+            self._index.flush()
+            self.written += 1
+
+
+class SessionReader:
+    """Memory-mapped, read-only access to a recorded session."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".index", "rb") as f:
+            magic, version = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{path}.index is not a session index (version {INDEX_VERSION})")
+
+        data_size = os.path.getsize(path + ".frames")
+        # Copy-on-write: callers may draw on replayed raw frames without touching the file
+        self.data = (np.memmap(path + ".frames", dtype=np.uint8, mode="c")
+                     if data_size else np.zeros(0, dtype=np.uint8))
+        count = (os.path.getsize(path + ".index") - INDEX_HEADER.size) // INDEX_DTYPE.itemsize
+        index = (np.memmap(path + ".index", dtype=INDEX_DTYPE, mode="r",
+                           offset=INDEX_HEADER.size, shape=(count,))
+                 if count else np.zeros(0, dtype=INDEX_DTYPE))
+        # Ignore a trailing entry whose payload never made it to disk
+        self.index = index[index["offset"] + index["length"] <= data_size]
+        self.frame_rows = np.flatnonzero(self.index["kind"] != KIND_RESPONSE)
+
+    def __len__(self):
+        """Number of frames (responses not counted)."""
+        return len(self.frame_rows)
+
+    def entry(self, i):
+        """Index entry of the i-th frame."""
+        return self.index[self.frame_rows[i]]
+
+    def payload(self, row):
+        entry = self.index[row]
+        return self.data[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def frame(self, i):
+        """The i-th frame as a BGR array; raw frames are a view into the mapped file."""
+        row = self.frame_rows[i]
+        entry = self.index[row]
+        payload = self.payload(row)
+        if entry["kind"] == KIND_RAW:
+            shape = (int(entry["height"]), int(entry["width"]), int(entry["channels"]))
+            return payload.reshape(shape if shape[2] > 1 else shape[:2])
+        return cv2.imdecode(payload, cv2.IMREAD_COLOR)
+
+    def jpeg(self, i, quality=90):
+        """The i-th frame as JPEG bytes plus its captured (w, h), encoding raw frames."""
+        entry = self.entry(i)
+        source_size = (int(entry["width"]), int(entry["height"]))
+        if entry["kind"] == KIND_JPEG:
+            return self.payload(self.frame_rows[i]).tobytes(), source_size
+        _, buffer = cv2.imencode(".jpg", self.frame(i), [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes(), source_size
+
+    def timestamps(self):
+        """Capture times of the frames, in seconds since the first one."""
+        times = self.index["timestamp"][self.frame_rows]
+        return times - times[0] if len(times) else times
+
+    def responses(self):
+        """[(frame_id, timestamp, data)] of the recorded server replies, in order."""
+        rows = np.flatnonzero(self.index["kind"] == KIND_RESPONSE)
+        return [(int(self.index[r]["frame_id"]), float(self.index[r]["timestamp"]),
+                 json.loads(self.payload(r).tobytes())) for r in rows]
+
+
+class ReplayFinished(Exception):
+    """Raised by ReplaySource.capture_array() after the last frame (unless looping)."""
+
+
+class ReplaySource:
+    """Plays a session back through the Picamera2 capture API (capture_array()).
+
+    `speed` 1.0 keeps the original frame timing, 2.0 plays twice as fast and
+    0 returns frames as fast as they are asked for. Pauses longer than
+    `max_gap` seconds (e.g. the wearable waiting to reconnect with nothing to
+    record) are shortened to `max_gap`; None keeps them.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, max_gap=1.0):
+        self.reader = SessionReader(path)
+        if not len(self.reader):
+            raise ValueError(f"Session {path} has no frames")
+        self.speed = speed
+        self.loop = loop
+        self.offsets = self.reader.timestamps()
+        if max_gap is not None and len(self.offsets):
+            gaps = np.minimum(np.diff(self.offsets, prepend=self.offsets[0]), max_gap)
+            self.offsets = np.cumsum(gaps)
+        self.position = 0
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def capture_array(self):
+        if self.position >= len(self.reader):
+            if not self.loop:
+                raise ReplayFinished()
+            self.position = 0
+            self._started = None
+        if self._started is None:
+            self.start()
+        if self.speed:
+            due = self._started + self.offsets[self.position] / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        frame = self.reader.frame(self.position)
+        self.position += 1
+        return frame
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
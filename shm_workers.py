@@ -0,0 +1,246 @@
+import asyncio
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+import inference_worker
+
+# Inference worker processes fed through shared memory (INFERENCE_EXECUTOR=shm).
+#
+# The front end decodes each JPEG on a small thread pool (cv2.imdecode releases
+# the GIL) and copies the pixels into a free slot of one shared memory block.
+# Only the slot number and frame shape go to a worker process over its task
+# queue; the worker wraps the slot in a numpy view and runs the model on it, so
+# pixel data is never pickled. Detections (a few rows per frame) come back on a
+# shared result queue, read by one thread that resolves the waiting futures.
+#
+# Each worker process holds its own models and takes the GIL only for its own
+# Python code, so frames/s scales with the number of workers until the cores
+# run out. Frames too large for a slot (judged from the JPEG header), or that find
+# no slot free, are sent as JPEG bytes and decoded in the worker.
+
+def _worker_main(shm_name, slot_bytes, tasks, results, torch_threads):
+    """Worker process: attach the frame slots, load the models, serve tasks."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    inference_worker.init_worker(torch_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, name, args = task
+        try:
+            if name == "frames":
+                value = _process_slots(shm, slot_bytes, *args)
+            else:
+                value = getattr(inference_worker, name)(*args)
+            results.put((task_id, True, value))
+        except Exception as e:
+            results.put((task_id, False, e))
+    shm.close()
+
+def _process_slots(shm, slot_bytes, mode, frames, source_sizes, decode_times, input_size):
+    """Run process_frames on frames given as (slot, shape), JPEG bytes or None."""
+    views = []
+    for i, frame in enumerate(frames):
+        if isinstance(frame, tuple):
+            slot, shape = frame
+            views.append(np.ndarray(shape, np.uint8, buffer=shm.buf, offset=slot * slot_bytes))
+        elif frame is not None:
+            start = time.perf_counter()
+            view, source_sizes[i] = inference_worker.decode_for_model(frame, source_sizes[i],
+                                                                      input_size)
+            views.append(view)
+            decode_times[i] = time.perf_counter() - start
+        else:
+            views.append(None)
+    batch = inference_worker.process_frames(mode, views, source_sizes)
+    batch["timings"]["decode"] = decode_times
+    del views  # no views may outlive the task: the front end reuses the slots
+    return batch
+
+
+class WorkerDied(RuntimeError):
+    """The worker process running a task exited before answering."""
+
+
+class SharedMemoryWorkers:
+    """Pool of inference worker processes with shared-memory frame slots.
+
+    `slots` frames of up to `slot_bytes` each can be in flight in shared memory at
+    once; frames beyond that are decoded by the worker instead of waiting. Must be
+    started (start()) from the server's event loop, since results are delivered
+    to asyncio futures.
+    """
+
+    def __init__(self, workers, torch_threads=0, slots=32, slot_bytes=1280 * 720 * 3,
+                 decode_threads=2):
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.slot_count = slots
+        self.slot_bytes = slot_bytes
+        self.decoder = ThreadPoolExecutor(max_workers=decode_threads)
+        self.shm = None
+        self.processes = []
+        self.task_queues = []
+        self.pending = {}  # task id -> (worker index, future)
+        self.load = [0] * workers  # tasks sent to each worker and not answered
+        self._ids = itertools.count()
+        self._stopping = False
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_count * self.slot_bytes)
+        self.free_slots = asyncio.Queue()
+        for slot in range(self.slot_count):
+            self.free_slots.put_nowait(slot)
+
+        # spawn: workers must not inherit the server's event loop and threads
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        for index in range(self.workers):
+            tasks = context.Queue()
+            process = context.Process(target=_worker_main, daemon=True,
+                                      args=(self.shm.name, self.slot_bytes, tasks,
+                                            self.results, self.torch_threads))
+            process.start()
+            self.task_queues.append(tasks)
+            self.processes.append(process)
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+        print(f"Started {self.workers} shm inference workers "
+              f"({self.slot_count} slots of {self.slot_bytes // 1024} KiB)")
+
+    def call(self, name, *args, worker=None):
+        """Run inference_worker.<name>(*args) in a worker (the least loaded one by default)."""
+        if worker is None:
+            worker = min(range(self.workers), key=self.load.__getitem__)
+        task_id = next(self._ids)
+        future = self.loop.create_future()
+        self.pending[task_id] = (worker, future)
+        self.load[worker] += 1
+        self.task_queues[worker].put((task_id, name, args))
+        return future
+
+    async def process_batch(self, mode, payloads, input_size=0):
+        """Same as inference_worker.process_batch, with decoding done here into shared memory."""
+        # Shielded: if the caller is cancelled the slots stay taken until the worker is done
+        return await asyncio.shield(self.loop.create_task(self._run_batch(mode, payloads, input_size)))
+
+    async def _run_batch(self, mode, payloads, input_size):
+        started = time.time()
+        # Slots are only taken when free, never waited for: batches holding some
+        # slots while waiting for more could deadlock each other
+        slots = [self._take_slot(data, input_size) for data, _ in payloads]
+        try:
+            decoded = iter(await asyncio.gather(*[
+                self.loop.run_in_executor(self.decoder, self._decode_into, data, source_size,
+                                          input_size, slot)
+                for (data, source_size), slot in zip(payloads, slots) if slot is not None]))
+            frames, sizes, decode_times = [], [], []
+            for (data, source_size), slot in zip(payloads, slots):
+                # Frames without a slot go as JPEG bytes: the worker decodes them
+                frame, size, seconds = (next(decoded) if slot is not None
+                                        else (bytes(data), source_size, 0.0))
+                frames.append(frame)
+                sizes.append(size)
+                decode_times.append(seconds)
+            batch = await self.call("frames", mode, frames, sizes, decode_times, input_size)
+        finally:
+            # The worker has answered (or died), so nothing reads the slots any more
+            for slot in slots:
+                if slot is not None:
+                    self.free_slots.put_nowait(slot)
+        batch["timings"]["started"] = started
+        return batch
+
+    def _take_slot(self, data, input_size):
+        """A free slot for the frame's decoded pixels, or None if there is none or it
+        wouldn't fit (size from the JPEG header; frames without one go to the worker)."""
+        size = inference_worker.jpeg_size(data)
+        if size is None:
+            return None
+        factor, _ = inference_worker.reduced_decode(size, input_size)
+        if -(-size[0] // factor) * -(-size[1] // factor) * 3 > self.slot_bytes:
+            return None
+        try:
+            return self.free_slots.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def _decode_into(self, data, source_size, input_size, slot):
+        """Decode a JPEG into `slot`; returns ((slot, shape) or bytes or None, reply size, seconds)."""
+        start = time.perf_counter()
+        frame, size = inference_worker.decode_for_model(data, source_size, input_size)
+        if frame is None:
+            return None, size, time.perf_counter() - start
+        if frame.nbytes > self.slot_bytes:
+            # Only if the JPEG header lied about the size (_take_slot checked it)
+            return bytes(data), source_size, 0.0
+        view = np.ndarray(frame.shape, np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        np.copyto(view, frame)
+        del view
+        return (slot, frame.shape), size, time.perf_counter() - start
+
+    def _read_results(self):
+        while not self._stopping:
+            try:
+                task_id, ok, value = self.results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+            self.loop.call_soon_threadsafe(self._resolve, task_id, ok, value)
+
+    def _resolve(self, task_id, ok, value):
+        worker, future = self.pending.pop(task_id, (None, None))
+        if future is None:
+            return
+        self.load[worker] -= 1
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _check_workers(self):
+        """Fail the tasks of worker processes that have exited (crash, OOM kill)."""
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                self.loop.call_soon_threadsafe(self._fail_worker, index, process.exitcode)
+
+    def _fail_worker(self, index, exitcode):
+        for task_id, (worker, future) in list(self.pending.items()):
+            if worker == index:
+                del self.pending[task_id]
+                if not future.done():
+                    future.set_exception(WorkerDied(f"inference worker {index} exited ({exitcode})"))
+        self.load[index] = float("inf")  # never picked again
+
+    def shutdown(self, wait=False, cancel_futures=True):
+        """Stop the workers and free the shared memory (same signature as an executor)."""
+        self._stopping = True
+        for tasks in self.task_queues:
+            tasks.put(None)
+        if cancel_futures:
+            for _, future in self.pending.values():
+                future.cancel()
+        for process in self.processes:
+            process.join(timeout=5.0 if wait else 1.0)
+            if process.is_alive():
+                process.terminate()
+        self._reader.join()
+        for q in self.task_queues + [self.results]:
+            q.close()
+            q.join_thread()
+        self.task_queues, self.results = [], None
+        self.decoder.shutdown(wait=wait)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
@@ -0,0 +1,203 @@
+import cv2
+import numpy as np
+
+# Detect-every-N tracking: the detector runs on some frames, and in between a cheap
+# tracker moves the last boxes along so every frame still gets results with stable
+# track ids. Used by the server (per connection) and by the standalone loops.
+#
+# Tracked detections are float32 arrays of [x1, y1, x2, y2, score, class_id, track_id].
+
+def iou_matrix(a, b):
+    """Pairwise IoU between two (N, 4+) and (M, 4+) box arrays."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class Track:
+    def __init__(self, track_id, detection):
+        self.id = track_id
+        self.box = detection[:4].astype(np.float32)
+        self.detected_box = self.box.copy()  # where the detector last saw it
+        self.score = float(detection[4])
+        self.class_id = int(detection[5])
+        self.velocity = np.zeros(4, dtype=np.float32)  # box change per frame
+        self.frames_since_seen = 0   # frames since the detector last matched this track
+        self.missed_detections = 0   # detector runs in a row that didn't match it
+
+    def as_row(self):
+        return [*self.box, self.score, self.class_id, self.id]
+
+
+class IoUTracker:
+    """Greedy IoU tracker with constant-velocity (or optical-flow) propagation.
+
+    update() takes fresh detector output, matches it to existing tracks of the
+    same class by IoU and starts new tracks for the rest. predict() moves every
+    track on by one frame without running the detector and decays its score, so
+    needs_detection() asks for the detector again once the tracks get stale.
+
+    Callers that run the detector asynchronously (the server) call
+    start_detection() when they submit a frame, so frames arriving before its
+    result are tracked instead of all going to the detector, and
+    cancel_detection() if that frame produced no result.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=2, score_decay=0.95):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.score_decay = score_decay
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.detection_pending = False   # a detector frame was submitted, no update() yet
+        self._force_detection = True     # nothing tracked yet: the next frame must be detected
+        self._next_id = 1
+
+    def update(self, detections):
+        """Match a detector result (N, 6) to the tracks. Returns the tracked (M, 7) array."""
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+        boxes = np.array([t.box for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        ious = iou_matrix(boxes, detections)
+        # Only same-class pairs may match
+        for i, track in enumerate(self.tracks):
+            ious[i, detections[:, 5].astype(int) != track.class_id] = 0
+
+        matched_tracks, matched_dets = set(), set()
+        for flat in np.argsort(-ious, axis=None):
+            i, j = np.unravel_index(flat, ious.shape)
+            if ious[i, j] < self.iou_threshold:
+                break
+            if i in matched_tracks or j in matched_dets:
+                continue
+            matched_tracks.add(i)
+            matched_dets.add(j)
+            track = self.tracks[i]
+            new_box = detections[j, :4]
+            elapsed = track.frames_since_seen + 1
+            track.velocity = (new_box - track.detected_box) / elapsed
+            track.box = new_box.copy()
+            track.detected_box = new_box.copy()
+            track.score = float(detections[j, 4])
+            track.frames_since_seen = 0
+            track.missed_detections = 0
+
+        survivors = []
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.missed_detections += 1
+                if track.missed_detections > self.max_missed:
+                    continue
+            survivors.append(track)
+        for j in range(len(detections)):
+            if j not in matched_dets:
+                survivors.append(Track(self._next_id, detections[j]))
+                self._next_id += 1
+
+        self.tracks = survivors
+        self.frames_since_detection = 0
+        self.detection_pending = False
+        self._force_detection = False
+        # Report only what the detector actually saw this frame
+        return self._rows([t for t in self.tracks if t.missed_detections == 0])
+
+    def predict(self, shifts=None):
+        """Move every track on by one frame. Returns the tracked (M, 7) array.
+
+        `shifts` is an optional (M, 2) array of per-track (dx, dy) from optical
+        flow; rows that are NaN fall back to the track's velocity.
+        """
+        for i, track in enumerate(self.tracks):
+            if shifts is not None and not np.isnan(shifts[i]).any():
+                dx, dy = shifts[i]
+                track.box += np.array([dx, dy, dx, dy], dtype=np.float32)
+            else:
+                track.box += track.velocity
+            track.score *= self.score_decay
+            track.frames_since_seen += 1
+        self.frames_since_detection += 1
+        return self._rows(self.tracks)
+
+    def needs_detection(self, detect_every, min_score):
+        """True when the next frame should go through the detector."""
+        if self.detection_pending:
+            return False
+        if self._force_detection or self.frames_since_detection + 1 >= detect_every:
+            return True
+        return any(t.score < min_score for t in self.tracks)
+
+    def boxes(self):
+        return np.array([t.box for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+
+    def start_detection(self):
+        """A frame went to the detector; its result will arrive through update()."""
+        self.detection_pending = True
+        self.frames_since_detection = 0
+
+    def cancel_detection(self):
+        """The submitted frame produced no result (decode or model error): detect the next one."""
+        self.detection_pending = False
+        self._force_detection = True
+
+    def reset(self):
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.detection_pending = False
+        self._force_detection = True
+
+    @staticmethod
+    def _rows(tracks):
+        return np.array([t.as_row() for t in tracks], dtype=np.float32).reshape(-1, 7)
+
+
+class FlowPropagator:
+    """Per-box motion between consecutive frames from sparse Lucas-Kanade optical flow.
+
+    Runs on a downscaled grayscale copy; each box moves by the median flow of
+    the corner features inside it.
+    """
+
+    def __init__(self, downscale=0.5, max_corners=200):
+        self.downscale = downscale
+        self.max_corners = max_corners
+        self.prev_gray = None
+
+    def shifts(self, frame, boxes):
+        """Return (M, 2) per-box shifts from the previous frame to this one (NaN if unknown)."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        gray = cv2.resize(gray, None, fx=self.downscale, fy=self.downscale,
+                          interpolation=cv2.INTER_AREA)
+        prev, self.prev_gray = self.prev_gray, gray
+
+        result = np.full((len(boxes), 2), np.nan, dtype=np.float32)
+        if prev is None or len(boxes) == 0 or prev.shape != gray.shape:
+            return result
+
+        small_boxes = (boxes * self.downscale).astype(int)
+        mask = np.zeros_like(prev)
+        for x1, y1, x2, y2 in small_boxes:
+            mask[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = 255
+        points = cv2.goodFeaturesToTrack(prev, self.max_corners, 0.01, 5, mask=mask)
+        if points is None:
+            return result
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None)
+        ok = status.ravel() == 1
+        start = points.reshape(-1, 2)[ok]
+        flow = (moved.reshape(-1, 2)[ok] - start) / self.downscale
+        for i, (x1, y1, x2, y2) in enumerate(small_boxes):
+            inside = ((start[:, 0] >= x1) & (start[:, 0] <= x2)
+                      & (start[:, 1] >= y1) & (start[:, 1] <= y2))
+            if inside.any():
+                result[i] = np.median(flow[inside], axis=0)
+        return result
+
+    def observe(self, frame):
+        """Remember a frame without computing shifts (e.g. on detector frames)."""
+        self.shifts(frame, np.zeros((0, 4), dtype=np.float32))
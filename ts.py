@@ -1,10 +1,11 @@
 import pyttsx3
+from audio_feedback import PRIORITY_SYSTEM, AudioPlayer, PhraseCache
 engine = pyttsx3.init()
 engine.setProperty('rate',120)
 engine.setProperty('volume',1.0)
-engine.say("Hello, 	welcome your helper is here")
-engine.runAndWait()
-engine.say("Two modes  present,currency detection and object recognition")
-engine.runAndWait()
-engine.say("Tell which mode you require")
-engine.runAndWait()
+# Phrases are synthesized on the first run only, then played from tts_cache/
+audio = AudioPlayer(clips={}, speech=PhraseCache(engine))
+audio.say("Hello, 	welcome your helper is here", PRIORITY_SYSTEM)
+audio.say("Two modes  present,currency detection and object recognition", PRIORITY_SYSTEM)
+audio.say("Tell which mode you require", PRIORITY_SYSTEM)
+audio.close()
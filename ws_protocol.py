@@ -0,0 +1,114 @@
+import struct
+import numpy as np
+
+# Wire format shared by client_wearable.py and server_inference.py.
+#
+# Client -> server binary messages are either a bare JPEG (legacy clients) or a
+# tagged frame: 1-byte tag + little-endian uint32 frame id + JPEG bytes.
+# A JPEG always starts with 0xFF, so the tag byte can never be mistaken for one.
+# The server echoes the frame id in the matching response.
+#
+# Clients that shrink frames to the model input size before encoding use the
+# resized-frame tag instead, which also carries the captured frame's width and
+# height; the server maps boxes back to that size before replying.
+
+FRAME_TAG = b"F"
+FRAME_HEADER = struct.Struct("<cI")
+RESIZED_FRAME_TAG = b"L"
+RESIZED_FRAME_HEADER = struct.Struct("<cIHH")
+
+def pack_frame(frame_id, jpeg_bytes, source_size=None):
+    """Prefix JPEG bytes with a frame id header (and the captured (w, h) if resized)."""
+    if source_size is not None:
+        header = RESIZED_FRAME_HEADER.pack(RESIZED_FRAME_TAG, frame_id & 0xFFFFFFFF, *source_size)
+        return header + jpeg_bytes
+    return FRAME_HEADER.pack(FRAME_TAG, frame_id & 0xFFFFFFFF) + jpeg_bytes
+
+def unpack_frame(payload):
+    """Split a binary message into (frame_id, source_size, jpeg_bytes).
+
+    frame_id is None for bare JPEGs, source_size is None unless the client
+    resized the frame.
+    """
+    tag = payload[:1]
+    if tag == FRAME_TAG and len(payload) >= FRAME_HEADER.size:
+        _, frame_id = FRAME_HEADER.unpack_from(payload)
+        return frame_id, None, payload[FRAME_HEADER.size:]
+    if tag == RESIZED_FRAME_TAG and len(payload) >= RESIZED_FRAME_HEADER.size:
+        _, frame_id, w, h = RESIZED_FRAME_HEADER.unpack_from(payload)
+        return frame_id, (w, h), payload[RESIZED_FRAME_HEADER.size:]
+    return None, None, payload
+
+# Server -> client results are JSON by default. A client can switch its
+# connection to compact binary results with "FORMAT:binary":
+#   header: 1-byte tag + uint32 frame id (0xFFFFFFFF if none) + uint8 mode index
+#           + uint32 dropped frames + uint16 detection count
+#   record: uint16 class id, uint16 score * SCORE_SCALE, int16 x1, y1, x2, y2,
+#           uint16 track id (0 when the connection isn't tracking)
+# Class names and the mode order are sent once in the "hello" event on connect.
+
+RESULT_FORMATS = ["json", "binary"]
+RESULT_TAG = b"R"
+RESULT_HEADER = struct.Struct("<cIBIH")
+NO_FRAME_ID = 0xFFFFFFFF
+SCORE_SCALE = 10000
+DETECTION_DTYPE = np.dtype([
+    ("class_id", "<u2"),
+    ("score", "<u2"),
+    ("box", "<i2", (4,)),
+    ("track_id", "<u2"),
+])
+
+def encode_results(frame_id, mode_index, dropped, detections):
+    """Pack an (N, 6) [x1, y1, x2, y2, score, class_id] array into a binary result message.
+
+    Tracked results are (N, 7) with the track id as the last column.
+    """
+    records = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+    records["class_id"] = detections[:, 5]
+    records["score"] = np.rint(detections[:, 4] * SCORE_SCALE)
+    records["box"] = np.clip(np.rint(detections[:, :4]), -32768, 32767)
+    if detections.shape[1] > 6:
+        records["track_id"] = detections[:, 6].astype(np.int64) & 0xFFFF
+    header = RESULT_HEADER.pack(RESULT_TAG, NO_FRAME_ID if frame_id is None else frame_id,
+                                mode_index, dropped, len(records))
+    return header + records.tobytes()
+
+def decode_results(payload):
+    """Unpack a binary result message into (frame_id, mode_index, dropped, records)."""
+    _, frame_id, mode_index, dropped, count = RESULT_HEADER.unpack_from(payload)
+    records = np.frombuffer(payload, dtype=DETECTION_DTYPE, count=count, offset=RESULT_HEADER.size)
+    return (None if frame_id == NO_FRAME_ID else frame_id), mode_index, dropped, records
+
+def detections_to_json(detections, class_names, class_sources=None):
+    """Convert an (N, 6) or tracked (N, 7) detection array into the JSON detection dicts.
+
+    `class_sources` (combined modes) names the model each class id comes from;
+    it is added to every detection as "source".
+    """
+    values = detections.astype(np.float64)
+    boxes = np.round(values[:, :4], 1).tolist()
+    scores = np.round(values[:, 4], 4).tolist()
+    class_ids = detections[:, 5].astype(np.int64).tolist()
+    result = [{"label": class_names[c], "score": s, "box": b}
+              for c, s, b in zip(class_ids, scores, boxes)]
+    if detections.shape[1] > 6:
+        for det, track_id in zip(result, detections[:, 6].astype(np.int64).tolist()):
+            det["track_id"] = track_id
+    if class_sources:
+        for det, c in zip(result, class_ids):
+            det["source"] = class_sources[c]
+    return result
+
+def records_to_detections(records, class_names, class_sources=None):
+    """Convert decoded binary records into the same dicts as the JSON format."""
+    scores = (records["score"] / SCORE_SCALE).tolist()
+    result = [{"label": class_names[c], "score": s, "box": b}
+              for c, s, b in zip(records["class_id"].tolist(), scores, records["box"].tolist())]
+    for det, track_id in zip(result, records["track_id"].tolist()):
+        if track_id:
+            det["track_id"] = track_id
+    if class_sources:
+        for det, c in zip(result, records["class_id"].tolist()):
+            det["source"] = class_sources[c]
+    return result
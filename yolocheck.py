@@ -1,24 +1,6 @@
-import cv2
-from picamera2 import Picamera2
+from local_runtime import LocalRuntime
 
-from ultralytics import YOLO
-
-picam2 = Picamera2()
-picam2.preview_configuration.main.size = (1280, 720)
-picam2.preview_configuration.main.format = "RGB888"
-picam2.preview_configuration.align()
-picam2.configure("preview")
-picam2.start()
-
-model = YOLO("yolo11n.pt")
-
-while True:
-    frame = picam2.capture_array()
-    results = model(frame)
-    annotated_frame = results[0].plot()
-    cv2.imshow("Camera", annotated_frame)
-
-    if cv2.waitKey(1) == ord("q"):
-        break
-
-cv2.destroyAllWindows()
\ No newline at end of file
+# Quick camera + model check: the stock YOLO11n model on the camera feed.
+runtime = LocalRuntime({"check": "yolo11n.pt"}, source="camera", size=(1280, 720),
+                       threshold=0.25, window="Camera")
+runtime.run()